@@ -0,0 +1,202 @@
+"""Measure request latency under concurrent load
+
+Requests are spread over a mix of paths by concurrent clients and the
+latency percentiles of each path are reported. Point it at the app on
+a device, e.g. after `adb forward tcp:5000 tcp:5000`:
+
+    python bench/load_test.py --url http://127.0.0.1:5000 \\
+        --path '/api/list?uri=...' --path '/thumb?uri=...'
+
+Background clients can keep slow requests, such as listings of a cloud
+provider, in flight the whole time with --background.
+
+With --demo, a local server runs the app's async view setup against a
+simulated provider instead. Background clients keep requesting a path
+that stands in for a provider query taking a second. The measured
+paths are quick listings, batched thumbnail futures and file chunks,
+which should keep their latency while it's running as long as there
+are JNI workers to spare.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+DEMO_PATHS = ['/list', '/thumbs', '/chunk']
+DEMO_BACKGROUND = ['/slow']
+
+
+def start_demo_server(jni_workers, slow_seconds):
+    import asyncio
+    import logging
+    from flask import Flask
+    from offload import offload, run_jni, wait_future
+    from werkzeug.serving import make_server
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    app = Flask(__name__)
+    app.jni_executor = ThreadPoolExecutor(
+        max_workers=jni_workers, thread_name_prefix='jni'
+    )
+    render_executor = ThreadPoolExecutor(max_workers=2)
+    chunk = os.urandom(64 * 1024)
+
+    def provider_query(seconds):
+        # Stands in for a blocking JNI call into a provider.
+        time.sleep(seconds)
+
+    @app.route('/slow')
+    @offload
+    def slow():
+        provider_query(slow_seconds)
+        return 'slow'
+
+    @app.route('/list')
+    @offload
+    def listing():
+        provider_query(0.005)
+        return {'entries': list(range(200))}
+
+    @app.route('/thumbs')
+    async def thumbs():
+        futures = await run_jni(lambda: [
+            render_executor.submit(time.sleep, 0.002) for _ in range(8)
+        ])
+        await asyncio.gather(*(wait_future(future) for future in futures))
+        return {'count': len(futures)}
+
+    @app.route('/chunk')
+    @offload
+    def file_chunk():
+        return app.response_class(chunk, mimetype='text/plain')
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def fetch(url, timeout):
+    start = time.monotonic()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+        ok = True
+    except (OSError, urllib.error.HTTPError):
+        ok = False
+    return time.monotonic() - start, ok
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def report(latencies, errors):
+    print(f'{"path":<40} {"n":>5} {"err":>4} {"p50 ms":>8} {"p95 ms":>8} '
+          f'{"p99 ms":>8} {"max ms":>8}')
+    for path, values in latencies.items():
+        stats = [percentile(values, f) * 1000 for f in (0.5, 0.95, 0.99)]
+        stats.append(max(values) * 1000 if values else float('nan'))
+        print(f'{path[:40]:<40} {len(values):>5} {errors[path]:>4} ' +
+              ' '.join(f'{value:>8.1f}' for value in stats))
+
+
+def run(base_url, paths, concurrency, requests, timeout,
+        background=(), background_clients=0):
+    jobs = list(itertools.islice(itertools.cycle(paths), requests))
+    latencies = {path: [] for path in [*paths, *background]}
+    errors = {path: 0 for path in latencies}
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def record(path, elapsed, ok):
+        with lock:
+            if ok:
+                latencies[path].append(elapsed)
+            else:
+                errors[path] += 1
+
+    def job(path):
+        record(path, *fetch(base_url + path, timeout))
+
+    def background_client(offset):
+        for path in itertools.islice(itertools.cycle(background), offset,
+                                     None):
+            if done.is_set():
+                return
+            record(path, *fetch(base_url + path, timeout))
+
+    clients = []
+    if background:
+        for i in range(background_clients):
+            client = threading.Thread(target=background_client, args=(i,))
+            client.start()
+            clients.append(client)
+        # Let the background requests get in flight first.
+        time.sleep(0.2)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(job, jobs))
+    total = time.monotonic() - start
+    done.set()
+    for client in clients:
+        client.join()
+
+    print(f'{requests} requests, {concurrency} concurrent, {total:.2f}s, '
+          f'{requests / total:.1f} req/s, '
+          f'{len(clients)} background clients')
+    report(latencies, errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', help='base URL of a running app')
+    parser.add_argument('--path', action='append', default=[],
+                        help='path to request, may be repeated')
+    parser.add_argument('--demo', action='store_true',
+                        help='run against a local simulated provider')
+    parser.add_argument('--background', action='append', default=[],
+                        help='path kept in flight by background clients')
+    parser.add_argument('--background-clients', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--jni-workers', type=int, default=16)
+    parser.add_argument('--slow-seconds', type=float, default=1.0)
+    args = parser.parse_args()
+
+    if args.demo:
+        server, base_url = start_demo_server(
+            args.jni_workers, args.slow_seconds
+        )
+        paths = args.path or DEMO_PATHS
+        background = args.background or DEMO_BACKGROUND
+    elif args.url:
+        server = None
+        base_url = args.url.rstrip('/')
+        paths = args.path or ['/']
+        background = args.background
+    else:
+        parser.error('--url or --demo is required')
+
+    try:
+        run(base_url, paths, args.concurrency, args.requests, args.timeout,
+            background, args.background_clients)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Measure server memory while streaming large documents
+
+Each document size is served with stream_file() by a fresh werkzeug
+server process, once with sendfile() and once with chunked reads, and
+downloaded in full. The server's peak RSS (VmHWM) before and after the
+download is reported, so the growth shows whether memory is bound by
+the chunk size rather than the document size. Linux only.
+
+    python bench/stream_rss.py [--sizes 10M,100M,1G]
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    if text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+def memory_kb(pid, field):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith(f'{field}:'):
+                return int(line.split()[1])
+    raise KeyError(field)
+
+
+def serve(path, sendfile, conn):
+    import logging
+    from flask import Flask
+    from streaming import stream_file
+    from werkzeug.serving import make_server
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    app = Flask(__name__)
+    app.config['VIEW_CHUNK_SIZE'] = 64 * 1024
+    app.config['VIEW_SENDFILE'] = sendfile
+
+    @app.route('/view')
+    def view():
+        return stream_file(open(path, 'rb'), 'application/octet-stream')
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    conn.send(server.server_port)
+    server.serve_forever()
+
+
+def download(url, chunk_size=1024 * 1024):
+    total = 0
+    with urllib.request.urlopen(url) as response:
+        while True:
+            chunk = response.read(chunk_size)
+            if not chunk:
+                break
+            total += len(chunk)
+    return total
+
+
+def measure(path, size, sendfile):
+    parent_conn, child_conn = multiprocessing.Pipe()
+    proc = multiprocessing.Process(
+        target=serve, args=(path, sendfile, child_conn), daemon=True
+    )
+    proc.start()
+    try:
+        url = f'http://127.0.0.1:{parent_conn.recv()}/view'
+        # Warm up imports and the request path before the baseline.
+        request = urllib.request.Request(url, headers={'Range': 'bytes=0-0'})
+        with urllib.request.urlopen(request) as response:
+            response.read()
+        before = memory_kb(proc.pid, 'VmHWM')
+
+        start = time.monotonic()
+        received = download(url)
+        elapsed = time.monotonic() - start
+        after = memory_kb(proc.pid, 'VmHWM')
+    finally:
+        proc.terminate()
+        proc.join()
+
+    if received != size:
+        raise RuntimeError(f'Received {received} of {size} bytes')
+    return before, after, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='10M,100M,1G')
+    args = parser.parse_args()
+
+    print(f'{"size":>8} {"mode":>9} {"peak before":>12} {"peak after":>11} '
+          f'{"growth":>8} {"MB/s":>8}')
+    with tempfile.TemporaryDirectory() as tmp:
+        for text in args.sizes.split(','):
+            size = parse_size(text)
+            path = os.path.join(tmp, f'doc-{size}')
+            with open(path, 'wb') as f:
+                # Sparse, so large documents don't need the disk space.
+                f.truncate(size)
+            for sendfile in (True, False):
+                before, after, elapsed = measure(path, size, sendfile)
+                mode = 'sendfile' if sendfile else 'chunked'
+                rate = size / elapsed / 1e6 if elapsed else 0
+                print(f'{text:>8} {mode:>9} {before:>9} kB {after:>8} kB '
+                      f'{after - before:>5} kB {rate:>8.1f}')
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
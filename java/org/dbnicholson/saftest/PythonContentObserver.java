@@ -0,0 +1,34 @@
+package org.dbnicholson.saftest;
+
+import android.database.ContentObserver;
+import android.net.Uri;
+import android.os.Handler;
+
+/**
+ * ContentObserver that forwards change notifications to a listener.
+ *
+ * ContentObserver is an abstract class, which pyjnius can't extend, so
+ * Python implements the Listener interface instead.
+ */
+public class PythonContentObserver extends ContentObserver {
+    public interface Listener {
+        void onChange(boolean selfChange, Uri uri);
+    }
+
+    private final Listener listener;
+
+    public PythonContentObserver(Handler handler, Listener listener) {
+        super(handler);
+        this.listener = listener;
+    }
+
+    @Override
+    public void onChange(boolean selfChange) {
+        onChange(selfChange, null);
+    }
+
+    @Override
+    public void onChange(boolean selfChange, Uri uri) {
+        listener.onChange(selfChange, uri);
+    }
+}
@@ -1,27 +1,117 @@
 import android.activity
+import asyncio
+import base64
+from cache import DiskCache, LRUCache
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    TimeoutError,
+    wait,
+)
 from contextlib import closing
+from cursor import LONG, STRING, iter_rows, read_rows
 from datetime import datetime
+from docindex import DocumentIndex
+from fdpool import FilePool
 from flask import (
     Flask,
     current_app,
     render_template,
     request,
+    send_file,
     url_for,
 )
+from functools import cached_property, partial, wraps
+import hashlib
+import io
+from itertools import islice
+import jnius
+import json
+from jinja2.filters import do_filesizeformat
 from jnius import autoclass, JavaException
 import logging
+from observer import DirectoryWatcher
+from offload import offload, run_jni, wait_future
 import os
+import stat
+from streaming import stream_file
+from textfile import LineIndex, open_reader, tail_offset
+import threading
+import time
+from transfer import pipe_copy
+import uris
+import zipfile
+from zipstream import iter_zip
 
 logger = logging.getLogger(__name__)
 
 Activity = autoclass('android.app.Activity')
+Bitmap = autoclass('android.graphics.Bitmap')
+BitmapFactory = autoclass('android.graphics.BitmapFactory')
+BitmapFactoryOptions = autoclass('android.graphics.BitmapFactory$Options')
+BuildVersion = autoclass('android.os.Build$VERSION')
+CompressFormat = autoclass('android.graphics.Bitmap$CompressFormat')
 Document = autoclass('android.provider.DocumentsContract$Document')
 DocumentFile = autoclass('androidx.documentfile.provider.DocumentFile')
 DocumentsContract = autoclass('android.provider.DocumentsContract')
+FileOutputStream = autoclass('java.io.FileOutputStream')
 Intent = autoclass('android.content.Intent')
+Point = autoclass('android.graphics.Point')
 PythonActivity = autoclass('org.kivy.android.PythonActivity')
 Uri = autoclass('android.net.Uri')
 
+# Projection used for directory listings as (column, entry key, type).
+LISTING_COLUMNS = (
+    (Document.COLUMN_DISPLAY_NAME, 'name', STRING),
+    (Document.COLUMN_DOCUMENT_ID, 'id', STRING),
+    (Document.COLUMN_LAST_MODIFIED, 'last_modified', LONG),
+    (Document.COLUMN_MIME_TYPE, 'mime_type', STRING),
+    (Document.COLUMN_SIZE, 'size', LONG),
+    (Document.COLUMN_FLAGS, 'flags', LONG),
+)
+LISTING_COLUMN_NAMES = [column for column, _, _ in LISTING_COLUMNS]
+LISTING_KEYS = [key for _, key, _ in LISTING_COLUMNS]
+LISTING_TYPES = [kind for _, _, kind in LISTING_COLUMNS]
+
+# Compression methods for /zip.
+ZIP_METHODS = {
+    'store': zipfile.ZIP_STORED,
+    'deflate': zipfile.ZIP_DEFLATED,
+}
+
+# Document types that can be viewed as text.
+TEXT_DOC_TYPES = (
+    'application/json',
+    'text/plain',
+)
+
+
+class UploadOffsetError(Exception):
+    """A resumed upload doesn't start at the end of the document"""
+    def __init__(self, offset, size):
+        super().__init__(
+            f'Upload offset {offset} does not match document size {size}'
+        )
+        self.offset = offset
+        self.size = size
+
+
+def detaching(func):
+    """Detach the calling thread from the JVM after func returns
+
+    Pool threads attach to the JVM on their first JNI call. Detach so
+    the thread doesn't hold a JNI environment when it exits. Only use
+    this for functions run on Python created threads.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            jnius.detach()
+    return wrapper
+
 
 class Browser(Flask):
     OPEN_DIRECTORY_REQUEST_CODE = 0xf11e
@@ -34,8 +124,535 @@ class Browser(Flask):
             self.activity.getLocalClassName(), Activity.MODE_PRIVATE
         )
 
+        # Directory listings are cached per tree document URI. The TTL
+        # bounds how stale a listing can get when another app changes
+        # the directory behind our back.
+        self.config.setdefault('LISTING_CACHE_SIZE', 32)
+        self.config.setdefault('LISTING_CACHE_TTL', 60)
+        self.config.setdefault('LISTING_CACHE_MAX_ENTRIES', 5000)
+
+        # Async views run their provider queries and other JNI calls on
+        # JNI_WORKERS long lived threads.
+        self.config.setdefault('JNI_WORKERS', 16)
+
+        # Number of entries rendered per page of the index.
+        self.config.setdefault('PAGE_SIZE', 200)
+
+        # Number of threads listing directories concurrently in walk().
+        self.config.setdefault('WALK_WORKERS', 4)
+
+        # Persistent document index. The default path is in the app's
+        # files directory. Indexed directories listed longer than
+        # INDEX_MAX_AGE seconds ago are refreshed in the background.
+        self.config.setdefault('INDEX_PATH', None)
+        self.config.setdefault('INDEX_MAX_AGE', 600)
+        self._pending_refreshes = set()
+        self._pending_lock = threading.Lock()
+
+        # Browsed directories are watched for changes by other apps.
+        # Change notifications within CHANGE_DELAY seconds of each other
+        # are handled as a single change.
+        self.config.setdefault('WATCH_LIMIT', 64)
+        self.config.setdefault('CHANGE_DELAY', 1.0)
+
+        # Recursive directory sizes are computed on SIZE_WORKERS threads
+        # and memoized per directory until its last modified time
+        # changes, for at most SIZE_CACHE_TTL seconds. Changes below a
+        # direct child don't update a directory's last modified time.
+        self.config.setdefault('SIZE_WORKERS', 2)
+        self.config.setdefault('SIZE_CACHE_SIZE', 4096)
+        self.config.setdefault('SIZE_CACHE_TTL', 300)
+        self.config.setdefault('SIZE_WAIT', 0.5)
+
+        # Size of the chunks documents are streamed to the client in.
+        self.config.setdefault('VIEW_CHUNK_SIZE', 64 * 1024)
+        self.config.setdefault('VIEW_SENDFILE', True)
+
+        # Default and maximum number of bytes returned by /view/region.
+        self.config.setdefault('VIEW_REGION_SIZE', 64 * 1024)
+        self.config.setdefault('VIEW_REGION_MAX', 1024 * 1024)
+
+        # Line offset indexes for /view/lines, cached per document
+        # version, and the default and maximum lines returned.
+        self.config.setdefault('LINE_INDEX_CACHE_SIZE', 16)
+        self.config.setdefault('VIEW_LINES', 200)
+        self.config.setdefault('VIEW_LINES_MAX', 10000)
+
+        # Follow mode polls the document size every FOLLOW_INTERVAL
+        # seconds and sends a keepalive after FOLLOW_KEEPALIVE seconds
+        # without new data. At most FOLLOW_CHUNK bytes go in one event.
+        self.config.setdefault('FOLLOW_INTERVAL', 0.5)
+        self.config.setdefault('FOLLOW_KEEPALIVE', 15)
+        self.config.setdefault('FOLLOW_CHUNK', 64 * 1024)
+
+        # Thumbnails are rendered on THUMB_WORKERS threads and cached as
+        # JPEGs in the app's cache directory, up to THUMB_CACHE_BYTES.
+        self.config.setdefault('THUMB_WORKERS', 2)
+        self.config.setdefault('THUMB_CACHE_BYTES', 64 * 1024 * 1024)
+        self.config.setdefault('THUMB_QUALITY', 85)
+        self.config.setdefault('THUMB_SIZE', 256)
+        self.config.setdefault('THUMB_MAX_SIZE', 1024)
+        self.config.setdefault('THUMB_BATCH_MAX', 64)
+        self._thumb_futures = {}
+        self._thumb_lock = threading.Lock()
+
+        # Documents are hashed in HASH_CHUNK_SIZE reads. hashlib releases
+        # the GIL for large updates, so concurrent hashes run in
+        # parallel. Digests are cached per document version.
+        self.config.setdefault('HASH_CHUNK_SIZE', 1024 * 1024)
+        self.config.setdefault('HASH_CACHE_SIZE', 1024)
+        self.config.setdefault(
+            'HASH_ALGORITHMS', ('md5', 'sha1', 'sha256', 'sha512')
+        )
+
+        # Directories are archived by /zip in ZIP_CHUNK_SIZE pieces.
+        # Most media is already compressed, so members are stored
+        # unless deflate is asked for.
+        self.config.setdefault('ZIP_CHUNK_SIZE', 256 * 1024)
+        self.config.setdefault('ZIP_METHOD', 'store')
+
+        # Uploads are copied from the request to the document in
+        # UPLOAD_CHUNK_SIZE pieces.
+        self.config.setdefault('UPLOAD_CHUNK_SIZE', 256 * 1024)
+
+        # Copies the provider can't do itself are pipelined through
+        # COPY_BUFFERS buffers of COPY_CHUNK_SIZE bytes.
+        self.config.setdefault('COPY_CHUNK_SIZE', 1024 * 1024)
+        self.config.setdefault('COPY_BUFFERS', 4)
+
+        # Idle read-only descriptors are kept open for reuse, up to
+        # FD_POOL_SIZE of them for FD_POOL_IDLE seconds each.
+        self.config.setdefault('FD_POOL_SIZE', 16)
+        self.config.setdefault('FD_POOL_IDLE', 30)
+
+        # Document metadata from listings and single document queries
+        # is cached per document URI for STAT_CACHE_TTL seconds.
+        self.config.setdefault('STAT_CACHE_SIZE', 10000)
+        self.config.setdefault('STAT_CACHE_TTL', 60)
+        self._size_futures = {}
+        self._size_lock = threading.Lock()
+
         android.activity.bind(on_activity_result=self.on_activity_result)
 
+    @cached_property
+    def jni_executor(self):
+        return ThreadPoolExecutor(
+            max_workers=self.config['JNI_WORKERS'],
+            thread_name_prefix='jni',
+        )
+
+    @cached_property
+    def listing_cache(self):
+        return LRUCache(
+            maxsize=self.config['LISTING_CACHE_SIZE'],
+            ttl=self.config['LISTING_CACHE_TTL'],
+        )
+
+    def invalidate_listing(self, tree_doc_uri):
+        if not isinstance(tree_doc_uri, str):
+            tree_doc_uri = tree_doc_uri.toString()
+        logger.debug('Invalidating cached listing for %s', tree_doc_uri)
+        entries = self.listing_cache.pop(tree_doc_uri)
+        if entries is None:
+            return False
+        # The children's stats were cached with the listing, so drop
+        # them too and changed documents are queried again.
+        for entry in entries:
+            self.stat_cache.invalidate(entry['uri'])
+        return True
+
+    def clear_listing_cache(self):
+        logger.debug('Clearing listing cache')
+        self.listing_cache.clear()
+
+    @cached_property
+    def watcher(self):
+        return DirectoryWatcher(
+            self.content_resolver,
+            self.on_directory_changed,
+            limit=self.config['WATCH_LIMIT'],
+            delay=self.config['CHANGE_DELAY'],
+        )
+
+    def watch_directory(self, tree_doc_uri, cursor):
+        """Watch a directory listed by cursor for changes
+
+        Notifications are matched by exact URI, so the observer is
+        registered on the cursor's notification URI. Providers often
+        notify the non-tree children URI rather than the tree one the
+        directory was queried with.
+        """
+        notification_uri = cursor.getNotificationUri()
+        if notification_uri is None:
+            logger.debug('Listing of %s has no notification URI',
+                         tree_doc_uri)
+        self.watcher.watch(tree_doc_uri, notification_uri)
+
+    def on_directory_changed(self, tree_doc_uri):
+        logger.info('Directory %s changed', tree_doc_uri)
+        self.invalidate_listing(tree_doc_uri)
+        self.size_cache.invalidate(tree_doc_uri)
+        if self.doc_index.directory(tree_doc_uri) is not None:
+            self.doc_index.mark_stale(tree_doc_uri)
+            self.schedule_refresh(tree_doc_uri)
+
+    @cached_property
+    def size_cache(self):
+        return LRUCache(
+            maxsize=self.config['SIZE_CACHE_SIZE'],
+            ttl=self.config['SIZE_CACHE_TTL'],
+        )
+
+    @cached_property
+    def size_executor(self):
+        return ThreadPoolExecutor(
+            max_workers=self.config['SIZE_WORKERS'],
+            thread_name_prefix='size',
+        )
+
+    def directory_size(self, tree_doc_uri, last_modified=None):
+        """Return the recursive size and file count of a directory
+
+        Totals are memoized by last modified time, so subdirectories
+        that haven't changed since they were last measured aren't
+        listed again. Providers generally only update a directory's
+        modification time when its direct children change, so totals
+        also expire after SIZE_CACHE_TTL. Directories without a last
+        modified time aren't memoized.
+        """
+        if isinstance(tree_doc_uri, Uri):
+            tree_doc_uri = tree_doc_uri.toString()
+        if last_modified:
+            cached = self.size_cache.get(tree_doc_uri)
+            if cached is not None and cached[0] == last_modified:
+                return cached[1]
+
+        totals = {'size': 0, 'files': 0}
+        for entry in self.list_files(tree_doc_uri, use_cache=False):
+            if entry['mime_type'] == Document.MIME_TYPE_DIR:
+                subtotals = self.directory_size(
+                    entry['uri'], entry['last_modified']
+                )
+                totals['size'] += subtotals['size']
+                totals['files'] += subtotals['files']
+            else:
+                totals['size'] += entry['size']
+                totals['files'] += 1
+
+        if last_modified:
+            self.size_cache.put(tree_doc_uri, (last_modified, totals))
+        return totals
+
+    def cached_directory_size(self, tree_doc_uri, last_modified):
+        cached = self.size_cache.get(tree_doc_uri)
+        if cached is not None and cached[0] == last_modified:
+            return cached[1]
+        return None
+
+    @detaching
+    def _directory_size_task(self, tree_doc_uri, last_modified):
+        return self.directory_size(tree_doc_uri, last_modified)
+
+    def schedule_directory_size(self, tree_doc_uri, last_modified):
+        """Compute a directory's size in the background
+
+        Returns a future for the totals. Requests for a directory that's
+        already being measured share the same future.
+        """
+        key = (tree_doc_uri, last_modified)
+        with self._size_lock:
+            future = self._size_futures.get(key)
+            if future is not None:
+                return future
+            future = self.size_executor.submit(
+                self._directory_size_task, tree_doc_uri, last_modified
+            )
+            self._size_futures[key] = future
+
+        def forget(future):
+            with self._size_lock:
+                self._size_futures.pop(key, None)
+
+        future.add_done_callback(forget)
+        return future
+
+    @cached_property
+    def line_index_cache(self):
+        return LRUCache(maxsize=self.config['LINE_INDEX_CACHE_SIZE'])
+
+    def get_line_index(self, uri, reader, st):
+        """Return the line index of a document open in reader
+
+        Indexes are cached by URI, size and modification time so a
+        changed document is indexed again.
+        """
+        key = (uri, st.st_size, st.st_mtime_ns)
+        index = self.line_index_cache.get(key)
+        if index is None:
+            logger.debug('Building line index for %s', uri)
+            index = LineIndex.build(reader)
+            self.line_index_cache.put(key, index)
+        return index
+
+    @cached_property
+    def hash_cache(self):
+        return LRUCache(maxsize=self.config['HASH_CACHE_SIZE'])
+
+    def hash_document(self, uri, algorithm):
+        """Return the hex digest and size of a document's content
+
+        Digests are cached by provider authority, document ID, size and
+        modification time, so the same document reached through
+        different trees shares an entry and a changed document is
+        hashed again. The key comes from fstat() on the descriptor, and
+        the document's cached metadata lets a pooled one be reused.
+        Returns the digest, the size and whether it was cached.
+        """
+        _, authority, _ = uris.split_uri(uri)
+        doc_id = uris.get_document_id(uri)
+        chunk_size = self.config['HASH_CHUNK_SIZE']
+        doc = self.stat_document(uri)
+        last_modified = None if doc is None else doc['last_modified']
+        with self.open_file(uri, 'rb', last_modified, buffering=0) as f:
+            st = os.fstat(f.fileno())
+            # Pipes have no stable size or time to key the cache on.
+            key = None
+            if stat.S_ISREG(st.st_mode):
+                key = (authority, doc_id, st.st_size, st.st_mtime_ns,
+                       algorithm)
+                digest = self.hash_cache.get(key)
+                if digest is not None:
+                    return digest, st.st_size, True
+
+            h = hashlib.new(algorithm)
+            buf = bytearray(chunk_size)
+            view = memoryview(buf)
+            size = 0
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                h.update(view[:n])
+                size += n
+
+        digest = h.hexdigest()
+        if key is not None:
+            self.hash_cache.put(key, digest)
+        return digest, size, False
+
+    @cached_property
+    def thumb_cache(self):
+        cache_dir = self.activity.getCacheDir().getAbsolutePath()
+        return DiskCache(
+            os.path.join(cache_dir, 'thumbnails'),
+            self.config['THUMB_CACHE_BYTES'],
+            suffix='.jpg',
+        )
+
+    @cached_property
+    def thumb_executor(self):
+        return ThreadPoolExecutor(
+            max_workers=self.config['THUMB_WORKERS'],
+            thread_name_prefix='thumb',
+        )
+
+    def decode_thumbnail(self, doc_uri, size):
+        """Decode an image document scaled to fit in size pixels
+
+        The image is subsampled by a power of 2 while decoding so the
+        full resolution bitmap is never allocated. Returns None if the
+        document can't be decoded.
+        """
+        options = BitmapFactoryOptions()
+        options.inJustDecodeBounds = True
+        with closing(self.content_resolver.openInputStream(doc_uri)) as stream:
+            BitmapFactory.decodeStream(stream, None, options)
+        width = options.outWidth
+        height = options.outHeight
+        if width <= 0 or height <= 0:
+            return None
+
+        sample = 1
+        while max(width, height) // (sample * 2) >= size:
+            sample *= 2
+        options.inJustDecodeBounds = False
+        options.inSampleSize = sample
+        with closing(self.content_resolver.openInputStream(doc_uri)) as stream:
+            bitmap = BitmapFactory.decodeStream(stream, None, options)
+        if bitmap is None:
+            return None
+
+        width = bitmap.getWidth()
+        height = bitmap.getHeight()
+        scale = size / max(width, height)
+        if scale < 1:
+            scaled = Bitmap.createScaledBitmap(
+                bitmap,
+                max(round(width * scale), 1),
+                max(round(height * scale), 1),
+                True,
+            )
+            bitmap.recycle()
+            bitmap = scaled
+        return bitmap
+
+    def render_thumbnail(self, uri, size, path):
+        """Write a JPEG thumbnail of a document to path
+
+        The provider's thumbnail is used when it has one. Otherwise the
+        image is decoded and scaled here. Returns False if no thumbnail
+        could be made.
+        """
+        doc_uri = Uri.parse(uri)
+        bitmap = None
+        try:
+            bitmap = DocumentsContract.getDocumentThumbnail(
+                self.content_resolver, doc_uri, Point(size, size), None
+            )
+        except JavaException as err:
+            logger.debug('No provider thumbnail for %s: %s', uri, err)
+        if bitmap is None:
+            try:
+                bitmap = self.decode_thumbnail(doc_uri, size)
+            except JavaException as err:
+                logger.debug('Cannot decode %s: %s', uri, err)
+        if bitmap is None:
+            return False
+
+        try:
+            with closing(FileOutputStream(path)) as out:
+                return bitmap.compress(
+                    CompressFormat.JPEG, self.config['THUMB_QUALITY'], out
+                )
+        finally:
+            bitmap.recycle()
+
+    @detaching
+    def _thumbnail_task(self, key, uri, size):
+        path = self.thumb_cache.temp_path(key)
+        try:
+            if not self.render_thumbnail(uri, size, path):
+                return None
+            return self.thumb_cache.put(key, path)
+        finally:
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def thumbnail_future(self, uri, size, last_modified=None):
+        """Return a future for the path of a cached JPEG thumbnail
+
+        Thumbnails are keyed by document URI and last modified time, so
+        an edited image gets a new thumbnail. If last_modified isn't
+        given, it's looked up with stat_document(). The future's result is
+        None if the document has no thumbnail.
+        """
+        if last_modified is None:
+            doc = self.stat_document(uri)
+            last_modified = 0 if doc is None else doc['last_modified']
+        key = f'{uri}|{last_modified}|{size}'
+        path = self.thumb_cache.get(key)
+        if path is not None:
+            future = Future()
+            future.set_result(path)
+            return future
+
+        # Concurrent requests for the same thumbnail share one render.
+        with self._thumb_lock:
+            future = self._thumb_futures.get(key)
+            created = future is None
+            if created:
+                future = self.thumb_executor.submit(
+                    self._thumbnail_task, key, uri, size
+                )
+                self._thumb_futures[key] = future
+
+        if created:
+            def forget(future):
+                with self._thumb_lock:
+                    self._thumb_futures.pop(key, None)
+
+            future.add_done_callback(forget)
+        return future
+
+    @cached_property
+    def doc_index(self):
+        path = self.config['INDEX_PATH']
+        if path is None:
+            files_dir = self.activity.getFilesDir().getAbsolutePath()
+            path = os.path.join(files_dir, 'index.sqlite3')
+        return DocumentIndex(path, max_age=self.config['INDEX_MAX_AGE'])
+
+    @cached_property
+    def index_executor(self):
+        return ThreadPoolExecutor(max_workers=1, thread_name_prefix='index')
+
+    @cached_property
+    def crawl_executor(self):
+        # Crawls get their own thread so a long one doesn't hold up
+        # refreshes of the directories being browsed.
+        return ThreadPoolExecutor(max_workers=1, thread_name_prefix='crawl')
+
+    def refresh_directory(self, tree_doc_uri):
+        """Reconcile the indexed children of a directory with the provider"""
+        if isinstance(tree_doc_uri, Uri):
+            tree_doc_uri = tree_doc_uri.toString()
+        tree = uris.build_tree_uri(tree_doc_uri)
+        # Index a listing that was just cached rather than querying the
+        # provider again. Otherwise, stream the children into the index
+        # so huge directories use bounded memory.
+        entries = self.listing_cache.get(tree_doc_uri)
+        if entries is None:
+            entries = self.iter_files(tree_doc_uri, watch=True)
+        self.doc_index.replace_children(tree, tree_doc_uri, entries)
+
+    @detaching
+    def _refresh_directory_task(self, tree_doc_uri):
+        try:
+            self.refresh_directory(tree_doc_uri)
+        except Exception:
+            logger.exception('Failed to refresh index of %s', tree_doc_uri)
+        finally:
+            with self._pending_lock:
+                self._pending_refreshes.discard(tree_doc_uri)
+
+    def schedule_refresh(self, tree_doc_uri):
+        """Refresh the indexed children of a directory in the background"""
+        if isinstance(tree_doc_uri, Uri):
+            tree_doc_uri = tree_doc_uri.toString()
+        with self._pending_lock:
+            if tree_doc_uri in self._pending_refreshes:
+                return
+            self._pending_refreshes.add(tree_doc_uri)
+        logger.debug('Scheduling index refresh of %s', tree_doc_uri)
+        self.index_executor.submit(
+            self._refresh_directory_task, tree_doc_uri
+        )
+
+    def crawl_tree(self, tree_uri):
+        """Index every directory of a tree"""
+        if isinstance(tree_uri, Uri):
+            tree_uri = tree_uri.toString()
+        tree = uris.build_tree_uri(tree_uri)
+        logger.info('Crawling tree %s', tree)
+        count = 0
+        for uri, directories, files in self.walk(tree_uri):
+            self.doc_index.replace_children(tree, uri, directories + files)
+            count += 1
+        logger.info('Indexed %d directories in %s', count, tree)
+
+    @detaching
+    def _crawl_tree_task(self, tree_uri):
+        try:
+            self.crawl_tree(tree_uri)
+        except Exception:
+            logger.exception('Failed to crawl %s', tree_uri)
+
+    def schedule_crawl(self, tree_uri):
+        """Index every directory of a tree in the background"""
+        if isinstance(tree_uri, Uri):
+            tree_uri = tree_uri.toString()
+        self.crawl_executor.submit(self._crawl_tree_task, tree_uri)
+
     def get_default_tree_uri(self):
         uri = self.preferences.getString('tree_uri', None)
         logger.info('Found default tree URI %s', uri)
@@ -60,9 +677,13 @@ class Browser(Flask):
                         uri.toString(), tree_id)
             self.set_default_tree_uri(uri)
 
-            logger.info('Persisting read permissions for "%s"', uri.toString())
-            flags = intent.getFlags() & Intent.FLAG_GRANT_READ_URI_PERMISSION
+            logger.info('Persisting permissions for "%s"', uri.toString())
+            flags = intent.getFlags() & (
+                Intent.FLAG_GRANT_READ_URI_PERMISSION |
+                Intent.FLAG_GRANT_WRITE_URI_PERMISSION
+            )
             self.content_resolver.takePersistableUriPermission(uri, flags)
+            self.schedule_crawl(uri)
 
             with self.app_context():
                 url = url_for('index', uri=uri.toString())
@@ -110,12 +731,180 @@ class Browser(Flask):
         pfd = afd.getParcelFileDescriptor()
         return pfd.detachFd()
 
-    def open_file(self, uri, mode='r', **kwargs):
+    @cached_property
+    def file_pool(self):
+        return FilePool(
+            partial(self.file_opener, flags=os.O_RDONLY),
+            maxsize=self.config['FD_POOL_SIZE'],
+            idle_timeout=self.config['FD_POOL_IDLE'],
+        )
+
+    def open_file(self, uri, mode='r', last_modified=None, **kwargs):
+        """Open a document like open()
+
+        Binary reads of a document whose last_modified is given get a
+        descriptor from the file pool, which is only reused while the
+        document's last_modified is the same. As with open(), buffering
+        0 gives an unbuffered file. Reads without last_modified always
+        open the document. Writes invalidate the pool.
+        """
         if isinstance(uri, Uri):
             uri = uri.toString()
+        if (
+            mode == 'rb' and
+            last_modified is not None and
+            kwargs.keys() <= {'buffering'}
+        ):
+            buffering = kwargs.get('buffering', -1)
+            if buffering < 0 or buffering == 1:
+                buffering = io.DEFAULT_BUFFER_SIZE
+            return self.file_pool.open(uri, last_modified, buffering)
+
+        if any(c in mode for c in 'wax+'):
+            self.file_pool.invalidate(uri)
+            self.stat_cache.invalidate(uri)
         kwargs['opener'] = self.file_opener
         return open(uri, mode, **kwargs)
 
+    def create_document(self, parent_uri, mime_type, name):
+        """Create an empty document in a directory and return its URI
+
+        The provider may change the name to avoid a conflict.
+        """
+        if isinstance(parent_uri, str):
+            parent_uri = Uri.parse(parent_uri)
+        doc_uri = DocumentsContract.createDocument(
+            self.content_resolver, parent_uri, mime_type, name
+        )
+        if doc_uri is None:
+            raise OSError(f'Cannot create {name} in {parent_uri.toString()}')
+        self.on_directory_changed(parent_uri.toString())
+        return doc_uri.toString()
+
+    def write_document(self, uri, stream, offset=0):
+        """Copy a binary stream into a document in chunks
+
+        With an offset of 0 the document is truncated. Otherwise the
+        stream is appended, and the document must already be offset
+        bytes long so an interrupted upload resumes where it stopped.
+        An UploadOffsetError is raised if it isn't. Returns the size of
+        the document.
+        """
+        chunk_size = self.config['UPLOAD_CHUNK_SIZE']
+        mode = 'ab' if offset else 'wb'
+        with self.open_file(uri, mode, buffering=0) as f:
+            if offset:
+                st = os.fstat(f.fileno())
+                # Pipes can't report how much was written before.
+                size = st.st_size if stat.S_ISREG(st.st_mode) else None
+                if size != offset:
+                    raise UploadOffsetError(offset, size)
+
+            size = offset
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                size += len(chunk)
+        return size
+
+    def _native_transfer(self, src_uri, src_parent_uri, dest_parent_uri):
+        """Have the provider copy or move a document itself
+
+        The document is moved if src_parent_uri is given and copied
+        otherwise. Returns the new document URI or None if the provider
+        can't do it.
+        """
+        # copyDocument() and moveDocument() were added in API 24 and
+        # only work within a provider.
+        if BuildVersion.SDK_INT < 24:
+            return None
+        if (
+            uris.split_uri(src_uri)[1] !=
+            uris.split_uri(dest_parent_uri)[1]
+        ):
+            return None
+
+        src = Uri.parse(src_uri)
+        dest_parent = Uri.parse(dest_parent_uri)
+        try:
+            if src_parent_uri is None:
+                doc_uri = DocumentsContract.copyDocument(
+                    self.content_resolver, src, dest_parent
+                )
+            else:
+                doc_uri = DocumentsContract.moveDocument(
+                    self.content_resolver, src, Uri.parse(src_parent_uri),
+                    dest_parent
+                )
+        except JavaException as err:
+            logger.debug('Provider cannot transfer %s: %s', src_uri, err)
+            return None
+        return None if doc_uri is None else doc_uri.toString()
+
+    def transfer_document(self, src_uri, dest_parent_uri,
+                          src_parent_uri=None):
+        """Copy or move a document into another directory
+
+        The document is moved if src_parent_uri is given and copied
+        otherwise. Either can be in any granted tree. The provider's
+        own copy or move is used when it supports it. Otherwise, the
+        content is piped between descriptors and, for a move, the
+        source is deleted afterwards. Returns the new document URI, the
+        number of bytes piped and whether the provider did it.
+        FileNotFoundError is raised for an unknown source and
+        IsADirectoryError for a directory the provider can't copy.
+        """
+        doc_uri = self._native_transfer(
+            src_uri, src_parent_uri, dest_parent_uri
+        )
+        if doc_uri is not None:
+            size = 0
+            native = True
+        else:
+            src = self.stat_document(src_uri)
+            if src is None:
+                raise FileNotFoundError(f'No document {src_uri}')
+            if src['mime_type'] == Document.MIME_TYPE_DIR:
+                raise IsADirectoryError(f'Cannot copy directory {src_uri}')
+            doc_uri = self.create_document(
+                dest_parent_uri, src['mime_type'], src['name']
+            )
+            try:
+                f = self.open_file(
+                    src_uri, 'rb', src['last_modified'], buffering=0
+                )
+                with f, self.open_file(doc_uri, 'wb', buffering=0) as dest:
+                    size = pipe_copy(
+                        f, dest,
+                        self.config['COPY_CHUNK_SIZE'],
+                        self.config['COPY_BUFFERS'],
+                    )
+            except BaseException:
+                # Don't let a failed cleanup hide why the copy failed.
+                try:
+                    DocumentsContract.deleteDocument(
+                        self.content_resolver, Uri.parse(doc_uri)
+                    )
+                except JavaException:
+                    logger.exception('Failed to delete partial copy %s',
+                                     doc_uri)
+                raise
+            if src_parent_uri is not None:
+                DocumentsContract.deleteDocument(
+                    self.content_resolver, Uri.parse(src_uri)
+                )
+            native = False
+
+        if src_parent_uri is not None:
+            self.file_pool.invalidate(src_uri)
+            self.stat_cache.invalidate(src_uri)
+        self.on_directory_changed(dest_parent_uri)
+        if src_parent_uri is not None:
+            self.on_directory_changed(src_parent_uri)
+        return doc_uri, size, native
+
     def get_tree(self, uri):
         if isinstance(uri, str):
             uri = Uri.parse(uri)
@@ -126,38 +915,223 @@ class Browser(Flask):
             uri = Uri.parse(uri)
         return DocumentFile.fromSingleUri(self.activity, uri)
 
-    def list_files(self, tree_doc_uri):
+    def query_children(self, tree_doc_uri):
+        if isinstance(tree_doc_uri, str):
+            tree_doc_uri = Uri.parse(tree_doc_uri)
         tree_doc_id = DocumentsContract.getDocumentId(tree_doc_uri)
         children_uri = DocumentsContract.buildChildDocumentsUriUsingTree(
             tree_doc_uri, tree_doc_id
         )
+        return self.content_resolver.query(
+            children_uri, LISTING_COLUMN_NAMES, None, None
+        )
+
+    @cached_property
+    def stat_cache(self):
+        return LRUCache(
+            maxsize=self.config['STAT_CACHE_SIZE'],
+            ttl=self.config['STAT_CACHE_TTL'],
+        )
+
+    def stat_document(self, uri):
+        """Return the list_files() entry for a single document
+
+        Entries are cached from directory listings, so a document that
+        was just listed costs no provider query. Otherwise the document
+        is queried for the listing columns alone. Returns None if the
+        provider doesn't know the document.
+        """
+        if isinstance(uri, Uri):
+            uri = uri.toString()
+        entry = self.stat_cache.get(uri)
+        if entry is not None:
+            return entry
+
+        cursor = self.content_resolver.query(
+            Uri.parse(uri), LISTING_COLUMN_NAMES, None, None
+        )
+        if cursor is None:
+            return None
+        with closing(cursor):
+            row = next(
+                iter_rows(cursor, LISTING_COLUMN_NAMES, LISTING_TYPES), None
+            )
+        if row is None:
+            return None
+        entry = dict(zip(LISTING_KEYS, row))
+        entry['uri'] = uri
+        self.stat_cache.put(uri, entry)
+        return entry
+
+    def cache_stats(self, entries):
+        for entry in entries:
+            self.stat_cache.put(entry['uri'], entry)
+
+    @staticmethod
+    def make_entry(row, uri_prefix):
+        entry = dict(zip(LISTING_KEYS, row))
+        # Building the document URI in Python saves calling
+        # buildDocumentUriUsingTree() and toString() for every row.
+        entry['uri'] = uri_prefix + uris.encode(entry['id'])
+        return entry
+
+    def iter_files(self, tree_doc_uri, offset=0, watch=False):
+        """Generate the children of a tree document
+
+        Directories small enough to be cached are read in bulk. Bigger
+        ones are walked lazily, so memory stays bounded and only the
+        entries consumed are read from the provider. Iteration starts
+        at row offset. With watch, the directory is watched for changes.
+        """
+        if isinstance(tree_doc_uri, Uri):
+            tree_doc_uri = tree_doc_uri.toString()
+        uri_prefix = uris.document_uri_prefix(tree_doc_uri)
+        with closing(self.query_children(tree_doc_uri)) as cursor:
+            if watch:
+                self.watch_directory(tree_doc_uri, cursor)
+            count = cursor.getCount()
+            if count <= self.config['LISTING_CACHE_MAX_ENTRIES']:
+                rows = read_rows(
+                    cursor, LISTING_COLUMN_NAMES, LISTING_TYPES
+                )[offset:]
+            else:
+                rows = iter_rows(
+                    cursor, LISTING_COLUMN_NAMES, LISTING_TYPES, offset
+                )
+            for row in rows:
+                yield self.make_entry(row, uri_prefix)
+
+    def list_files(self, tree_doc_uri, offset=0, limit=None, use_cache=True):
+        if isinstance(tree_doc_uri, Uri):
+            tree_doc_uri = tree_doc_uri.toString()
+        key = tree_doc_uri
+        stop = None if limit is None else offset + limit
+        if use_cache:
+            results = self.listing_cache.get(key)
+            if results is not None:
+                logger.debug('Using cached listing for %s', key)
+                return results[offset:stop]
+
+        uri_prefix = uris.document_uri_prefix(key)
+        with closing(self.query_children(tree_doc_uri)) as cursor:
+            if use_cache:
+                self.watch_directory(key, cursor)
+            # Huge directories are never cached. When a page is asked
+            # for, only that page is read so memory is bounded by the
+            # page size. Its stats aren't cached either, since there's
+            # no cached listing to invalidate them with on a change.
+            count = cursor.getCount()
+            max_entries = self.config['LISTING_CACHE_MAX_ENTRIES']
+            if limit is not None and count > max_entries:
+                logger.debug('Reading rows %d-%d of %d for %s',
+                             offset, stop, count, key)
+                rows = islice(
+                    iter_rows(
+                        cursor, LISTING_COLUMN_NAMES, LISTING_TYPES, offset
+                    ),
+                    limit,
+                )
+                return [self.make_entry(row, uri_prefix) for row in rows]
+
+            rows = read_rows(cursor, LISTING_COLUMN_NAMES, LISTING_TYPES)
+
+        results = [self.make_entry(row, uri_prefix) for row in rows]
+        # Bulk listings of walks and crawls don't cache stats, so they
+        # don't evict those of the directories being browsed.
+        if use_cache and count <= max_entries:
+            self.listing_cache.put(key, results)
+            self.cache_stats(results)
+        return results[offset:stop]
+
+    @detaching
+    def _list_directory(self, uri):
+        return self.list_files(uri, use_cache=False)
+
+    def walk(self, tree_uri, max_depth=None, onerror=None):
+        """Generate the directories of a tree like os.walk()
+
+        Each item is a (uri, directories, files) tuple where directories
+        and files are lists of list_files() entries. Sibling directories
+        are listed concurrently on a pool of WALK_WORKERS threads and
+        yielded as soon as their listing arrives, so the order is not
+        deterministic, though a directory always comes before its
+        children. Directories deeper than max_depth below the top are
+        not listed. Listing errors are passed to onerror if given and
+        otherwise ignored.
+        """
+        top = self.get_tree(tree_uri).getUri().toString()
+        executor = ThreadPoolExecutor(
+            max_workers=self.config['WALK_WORKERS'],
+            thread_name_prefix='walk',
+        )
+        pending = {executor.submit(self._list_directory, top): (top, 0)}
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    uri, depth = pending.pop(future)
+                    try:
+                        entries = future.result()
+                    except Exception as err:
+                        logger.debug('Cannot list %s: %s', uri, err)
+                        if onerror is not None:
+                            onerror(err)
+                        continue
+
+                    directories = []
+                    files = []
+                    for entry in entries:
+                        if entry['mime_type'] == Document.MIME_TYPE_DIR:
+                            directories.append(entry)
+                        else:
+                            files.append(entry)
+
+                    yield uri, directories, files
 
-        columns = [
-            Document.COLUMN_DISPLAY_NAME,
-            Document.COLUMN_DOCUMENT_ID,
-            Document.COLUMN_LAST_MODIFIED,
-            Document.COLUMN_MIME_TYPE,
-            Document.COLUMN_SIZE,
-        ]
-        results = []
-        with closing(
-            self.content_resolver.query(children_uri, columns, None, None)
-        ) as cursor:
-            while cursor.moveToNext():
-                entry = {
-                    'name': cursor.getString(0),
-                    'id': cursor.getString(1),
-                    'last_modified': cursor.getLong(2),
-                    'mime_type': cursor.getString(3),
-                    'size': cursor.getLong(4),
-                }
-                doc_uri = DocumentsContract.buildDocumentUriUsingTree(
-                    tree_doc_uri, entry['id']
+                    # Like os.walk(), the caller can prune directories
+                    # in place before they're descended into.
+                    if max_depth is None or depth < max_depth:
+                        for entry in directories:
+                            child = executor.submit(
+                                self._list_directory, entry['uri']
+                            )
+                            pending[child] = (entry['uri'], depth + 1)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def zip_members(self, tree_uri):
+        """Generate iter_zip() members for the documents in a tree
+
+        Member names are paths relative to the top of the tree. Each
+        document is opened only when the archive reaches it.
+        """
+        top = self.get_tree(tree_uri).getUri().toString()
+        paths = {top: ''}
+        for uri, directories, files in self.walk(top):
+            prefix = paths.pop(uri)
+            for entry in directories:
+                path = f'{prefix}{entry["name"]}/'
+                paths[entry['uri']] = path
+                yield path, entry['last_modified'], 0, None
+            for entry in files:
+                yield (
+                    prefix + entry['name'],
+                    entry['last_modified'],
+                    entry['size'],
+                    partial(
+                        self._open_member, entry['uri'],
+                        entry['last_modified'],
+                    ),
                 )
-                entry['uri'] = doc_uri.toString()
-                results.append(entry)
 
-        return results
+    def _open_member(self, uri, last_modified):
+        try:
+            return self.open_file(
+                uri, 'rb', buffering=0, last_modified=last_modified
+            )
+        except JavaException as err:
+            # Let iter_zip() skip documents the provider can't open.
+            raise OSError(f'Cannot open {uri}: {err}') from err
 
 
 app = Browser(__name__)
@@ -165,6 +1139,7 @@ app.config['SERVER_NAME'] = '127.0.0.1:5000'
 
 
 @app.route('/')
+@offload
 def index():
     uri = request.args.get('uri')
     if not uri:
@@ -172,50 +1147,412 @@ def index():
 
     if uri:
         logger.info('Rendering tree URI %s', uri)
-        tree_doc_uri = current_app.get_tree(uri).getUri()
+        tree_doc_uri = current_app.get_tree(uri).getUri().toString()
+        refresh = request.args.get('refresh')
+        source = request.args.get('source')
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        limit = request.args.get(
+            'limit', current_app.config['PAGE_SIZE'], type=int
+        )
+        limit = max(limit, 1)
+
+        # Render from the document index when the directory has been
+        # indexed. Otherwise, list it from the provider and index it in
+        # the background for next time. Ask for one extra entry to find
+        # out if there's another page. The provider and the index order
+        # entries differently, so once the first page has come from the
+        # provider, the following pages do too.
+        indexed = None
+        if not refresh and source != 'provider':
+            indexed = current_app.doc_index.directory(tree_doc_uri)
+        if indexed is not None:
+            docs = current_app.doc_index.children(
+                tree_doc_uri, offset, limit + 1
+            )
+            # A directory that isn't watched, such as after a restart,
+            # is refreshed too, which watches it again.
+            if indexed['stale'] or tree_doc_uri not in current_app.watcher:
+                current_app.schedule_refresh(tree_doc_uri)
+            indexed['listed'] = datetime.fromtimestamp(indexed['listed'])
+        else:
+            if refresh:
+                current_app.invalidate_listing(tree_doc_uri)
+            docs = current_app.list_files(tree_doc_uri, offset, limit + 1)
+            if source != 'provider':
+                current_app.schedule_refresh(tree_doc_uri)
+            source = 'provider'
+        more = len(docs) > limit
         directories = []
         files = []
-        for doc in current_app.list_files(tree_doc_uri):
+        for doc in docs[:limit]:
+            # Document.COLUMN_LAST_MODIFIED returns milliseconds since
+            # the epoch.
+            last_modified = datetime.fromtimestamp(
+                doc['last_modified'] / 1000
+            )
             if doc['mime_type'] == Document.MIME_TYPE_DIR:
                 directories.append({
                     'name': doc['name'],
                     'uri': doc['uri'],
+                    'last_modified': last_modified,
+                    'mtime': doc['last_modified'],
+                    'totals': current_app.cached_directory_size(
+                        doc['uri'], doc['last_modified']
+                    ),
                 })
             else:
-                # Document.COLUMN_LAST_MODIFIED returns milliseconds
-                # since the epoch.
-                last_modified = datetime.fromtimestamp(
-                    doc['last_modified'] / 1000
-                )
                 files.append({
                     'name': doc['name'],
                     'uri': doc['uri'],
                     'last_modified': last_modified,
+                    'mtime': doc['last_modified'],
                     'size': doc['size'],
+                    'image': (doc['mime_type'] or '').startswith('image/'),
                 })
 
-        name = DocumentsContract.getDocumentId(tree_doc_uri)
+        name = uris.get_document_id(tree_doc_uri)
         content = {
             'name': name,
+            'uri': uri,
+            # The tree root URI resolved to its document, which
+            # DocumentsContract calls on the directory need.
+            'doc_uri': tree_doc_uri,
+            'indexed': indexed,
+            'source': source,
             'directories': directories,
             'files': files,
+            'offset': offset,
+            'limit': limit,
+            'more': more,
         }
     else:
         content = {}
 
+    view = request.args.get('view')
     return render_template(
-        'index.html',
+        'gallery.html' if view == 'gallery' else 'index.html',
         content=content,
+        view=view,
     )
 
 
+@app.route('/search')
+@offload
+def search():
+    query = request.args.get('q', '').strip()
+    uri = request.args.get('uri')
+    if not uri:
+        uri = current_app.get_default_tree_uri()
+    fuzzy = bool(request.args.get('fuzzy'))
+    limit = max(request.args.get('limit', 100, type=int), 1)
+
+    results = []
+    if query and uri:
+        tree = uris.build_tree_uri(uri)
+        logger.info('Searching %s for "%s"', tree, query)
+        for doc in current_app.doc_index.search(tree, query, fuzzy, limit):
+            doc['directory'] = doc['mime_type'] == Document.MIME_TYPE_DIR
+            doc['last_modified'] = datetime.fromtimestamp(
+                doc['last_modified'] / 1000
+            )
+            results.append(doc)
+
+    return render_template(
+        'search.html',
+        query=query,
+        uri=uri,
+        fuzzy=fuzzy,
+        results=results,
+    )
+
+
+@app.route('/api/list')
+@offload
+def api_list():
+    uri = request.args.get('uri')
+    if not uri:
+        uri = current_app.get_default_tree_uri()
+    if not uri:
+        return ('No uri argument specified', 400)
+
+    tree_doc_uri = current_app.get_tree(uri).getUri().toString()
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(limit, 0)
+    docs = current_app.list_files(tree_doc_uri, offset, limit)
+
+    # Columnar arrays avoid repeating the keys for every document.
+    keys = LISTING_KEYS + ['uri']
+    listing = {
+        'uri': tree_doc_uri,
+        'offset': offset,
+        'count': len(docs),
+        'columns': {key: [doc[key] for doc in docs] for key in keys},
+    }
+    data = json.dumps(
+        listing, ensure_ascii=False, separators=(',', ':')
+    ).encode('utf-8')
+
+    response = current_app.response_class(data, mimetype='application/json')
+    response.set_etag(hashlib.sha256(data).hexdigest())
+    return response.make_conditional(request)
+
+
+@app.route('/size')
+async def directory_size():
+    uri = request.args.get('uri')
+    if uri is None:
+        return ('No uri argument specified', 400)
+    last_modified = request.args.get('last_modified', type=int)
+
+    future = current_app.schedule_directory_size(uri, last_modified)
+    try:
+        totals = await wait_future(future, current_app.config['SIZE_WAIT'])
+    except TimeoutError:
+        return ({'pending': True}, 202)
+
+    return {
+        'size': totals['size'],
+        'files': totals['files'],
+        'size_text': do_filesizeformat(totals['size']),
+    }
+
+
+@app.route('/thumb')
+async def thumbnail():
+    uri = request.args.get('uri')
+    if uri is None:
+        return ('No uri argument specified', 400)
+    config = current_app.config
+    size = request.args.get('size', config['THUMB_SIZE'], type=int)
+    size = min(max(size, 16), config['THUMB_MAX_SIZE'])
+    last_modified = request.args.get('last_modified', type=int)
+
+    # The cached file can be evicted between looking it up and opening
+    # it, in which case it's rendered again.
+    for _ in range(2):
+        future = await run_jni(
+            current_app.thumbnail_future, uri, size, last_modified
+        )
+        path = await wait_future(future)
+        if path is None:
+            return ('No thumbnail available', 415)
+        try:
+            f = open(path, 'rb')
+            break
+        except FileNotFoundError:
+            logger.debug('Thumbnail %s was evicted', path)
+    else:
+        return ('Thumbnail evicted', 503)
+    # A URL with the modification time always names the same image, so
+    # the client can keep it.
+    max_age = None if last_modified is None else 86400
+    return send_file(f, mimetype='image/jpeg', max_age=max_age)
+
+
+@app.route('/thumbs')
+async def thumbnails():
+    """Return a batch of thumbnails as JSON data URIs
+
+    Documents are given by repeated uri and last_modified arguments in
+    the same order. Thumbnails are rendered concurrently and the result
+    maps each URI to a data URI or null if it has no thumbnail.
+    """
+    doc_uris = request.args.getlist('uri')
+    if not doc_uris:
+        return ('No uri argument specified', 400)
+    config = current_app.config
+    if len(doc_uris) > config['THUMB_BATCH_MAX']:
+        return ('Too many uri arguments', 400)
+    size = request.args.get('size', config['THUMB_SIZE'], type=int)
+    size = min(max(size, 16), config['THUMB_MAX_SIZE'])
+    last_modified = request.args.getlist('last_modified', type=int)
+    last_modified += [None] * (len(doc_uris) - len(last_modified))
+
+    futures = await run_jni(lambda: [
+        current_app.thumbnail_future(uri, size, mtime)
+        for uri, mtime in zip(doc_uris, last_modified)
+    ])
+    paths = await asyncio.gather(
+        *(wait_future(future) for future in futures),
+        return_exceptions=True,
+    )
+    results = {}
+    for uri, path in zip(doc_uris, paths):
+        if isinstance(path, Exception):
+            logger.error('Failed to make thumbnail of %s', uri,
+                         exc_info=path)
+            path = None
+        data = None
+        if path is not None:
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                # Evicted since it was looked up, so report it missing
+                # rather than failing the batch.
+                logger.debug('Thumbnail %s was evicted', path)
+        if data is None:
+            results[uri] = None
+            continue
+        data = base64.b64encode(data).decode('ascii')
+        results[uri] = f'data:image/jpeg;base64,{data}'
+
+    return results
+
+
+@app.route('/hash')
+def hash_file():
+    uri = request.args.get('uri')
+    if uri is None:
+        return ('No uri argument specified', 400)
+    algorithm = request.args.get('algo', 'sha256').lower()
+    if algorithm not in current_app.config['HASH_ALGORITHMS']:
+        return (f'Unsupported hash algorithm {algorithm}', 400)
+
+    start = time.monotonic()
+    digest, size, cached = current_app.hash_document(uri, algorithm)
+    elapsed = time.monotonic() - start
+    logger.info('Hashed %s (%d bytes) with %s in %.3fs%s',
+                uri, size, algorithm, elapsed, ' (cached)' if cached else '')
+    return {
+        'algorithm': algorithm,
+        'digest': digest,
+        'size': size,
+        'cached': cached,
+    }
+
+
+@app.route('/zip')
+def zip_directory():
+    uri = request.args.get('uri')
+    if uri is None:
+        return ('No uri argument specified', 400)
+    config = current_app.config
+    method = request.args.get('method', config['ZIP_METHOD'])
+    if method not in ZIP_METHODS:
+        return (f'Unsupported compression method {method}', 400)
+
+    name = current_app.get_tree(uri).getName() or 'archive'
+    logger.info('Archiving %s with %s', uri, method)
+    # The archive is generated after the request context is gone, so
+    # nothing in it can use current_app.
+    body = iter_zip(
+        current_app.zip_members(uri),
+        ZIP_METHODS[method],
+        config['ZIP_CHUNK_SIZE'],
+    )
+    response = current_app.response_class(body, mimetype='application/zip')
+    response.headers.set(
+        'Content-Disposition', 'attachment', filename=f'{name}.zip'
+    )
+    return response
+
+
+@app.route('/upload', methods=['PUT'])
+def upload_file():
+    """Stream the request body into a document
+
+    A new document is created with the parent, name and optional mime
+    arguments. An interrupted upload is resumed by sending the rest of
+    the content with the uri of the created document and the offset to
+    continue from. A mismatched offset returns 409 with the current
+    size.
+    """
+    uri = request.args.get('uri')
+    offset = request.args.get('offset', 0, type=int)
+    if uri is None:
+        parent = request.args.get('parent')
+        name = request.args.get('name')
+        if parent is None or not name:
+            return ('No uri or parent and name arguments specified', 400)
+        mime_type = (
+            request.args.get('mime') or
+            request.mimetype or
+            'application/octet-stream'
+        )
+        # A tree root URI has to be resolved to its document first.
+        parent = current_app.get_tree(parent).getUri()
+        uri = current_app.create_document(parent, mime_type, name)
+        status = 201
+        offset = 0
+    else:
+        if offset < 0:
+            return ('Invalid offset argument', 400)
+        status = 200
+
+    logger.info('Uploading to %s at offset %d', uri, offset)
+    try:
+        size = current_app.write_document(uri, request.stream, offset)
+    except UploadOffsetError as err:
+        return ({'uri': uri, 'size': err.size, 'error': str(err)}, 409)
+
+    return ({'uri': uri, 'size': size}, status)
+
+
+@app.route('/copy', methods=['POST'])
+def copy_file():
+    """Copy or move the uri document into the dest directory
+
+    Giving the parent directory of the document moves it instead.
+    """
+    uri = request.args.get('uri')
+    dest = request.args.get('dest')
+    if uri is None or dest is None:
+        return ('No uri and dest arguments specified', 400)
+    parent = request.args.get('parent')
+    # Tree root URIs have to be resolved to their documents first.
+    dest = current_app.get_tree(dest).getUri().toString()
+    if parent is not None:
+        parent = current_app.get_tree(parent).getUri().toString()
+
+    start = time.monotonic()
+    try:
+        doc_uri, size, native = current_app.transfer_document(
+            uri, dest, parent
+        )
+    except FileNotFoundError as err:
+        return (str(err), 404)
+    except IsADirectoryError as err:
+        return (str(err), 409)
+    elapsed = time.monotonic() - start
+    rate = size / elapsed / 1e6 if elapsed > 0 else 0
+    logger.info('%s %s to %s in %.3fs%s',
+                'Moved' if parent else 'Copied', uri, doc_uri, elapsed,
+                ' by the provider' if native else f' at {rate:.1f} MB/s')
+    return ({
+        'uri': doc_uri,
+        'native': native,
+        'size': size,
+        'seconds': elapsed,
+        'mb_per_second': None if native else rate,
+    }, 201)
+
+
+@app.route('/stats')
+def stats():
+    return {
+        'listing_cache': current_app.listing_cache.stats(),
+        'size_cache': current_app.size_cache.stats(),
+        'line_index_cache': current_app.line_index_cache.stats(),
+        'hash_cache': current_app.hash_cache.stats(),
+        'file_pool': current_app.file_pool.stats(),
+        'stat_cache': current_app.stat_cache.stats(),
+        'thumb_cache': current_app.thumb_cache.stats(),
+        'watched_directories': len(current_app.watcher),
+    }
+
+
 @app.route('/open')
+@offload
 def open_directory():
     current_app.open_directory()
     return ('', 204)
 
 
 @app.route('/view')
+@offload
 def view_file():
     uri = request.args.get('uri')
     if uri is None:
@@ -225,16 +1562,231 @@ def view_file():
     if current_app.view_file(doc_uri):
         return ('', 204)
 
-    doc = current_app.get_file(doc_uri)
-    doc_type = doc.getType()
-    text_doc_types = (
-        'application/json',
-        'text/plain',
-    )
+    doc = current_app.stat_document(uri)
+    doc_type = None if doc is None else doc['mime_type']
     logger.info('Document %s MIME: %s', uri, doc_type)
-    if doc_type in text_doc_types:
-        with current_app.open_file(uri, 'rb') as f:
-            text = f.read()
-        return (text, 200)
+    if doc_type in TEXT_DOC_TYPES:
+        f = current_app.open_file(uri, 'rb', doc['last_modified'])
+        return stream_file(f, doc_type)
 
     return ('Cannot view file', 415)
+
+
+@app.route('/view/region')
+@offload
+def view_region():
+    """Return whole lines from a region of a text document
+
+    The region starts at byte offset, counted from the end if negative,
+    and spans about length bytes expanded to line boundaries. With q,
+    the region starts at the line containing the first match of q at or
+    after offset.
+    """
+    uri = request.args.get('uri')
+    if uri is None:
+        return ('No uri argument specified', 400)
+    offset = request.args.get('offset', 0, type=int)
+    length = request.args.get(
+        'length', current_app.config['VIEW_REGION_SIZE'], type=int
+    )
+    length = min(max(length, 0), current_app.config['VIEW_REGION_MAX'])
+    query = request.args.get('q')
+
+    doc = current_app.stat_document(uri)
+    if doc is None or doc['mime_type'] not in TEXT_DOC_TYPES:
+        return ('Cannot view file', 415)
+
+    with current_app.open_file(uri, 'rb', doc['last_modified']) as f:
+        try:
+            reader = open_reader(f)
+        except ValueError as err:
+            return (str(err), 501)
+
+        with reader:
+            if offset < 0:
+                offset += reader.size
+            if query:
+                match = reader.find(query.encode('utf-8'), max(offset, 0))
+                if match < 0:
+                    return ('No match', 404)
+                offset = match
+            start, stop = reader.region(offset, offset + length)
+            # Don't let a very long line blow past the maximum.
+            region_max = current_app.config['VIEW_REGION_MAX']
+            start = max(start, offset - region_max)
+            stop = min(stop, start + region_max)
+            data = reader.read(start, stop)
+            size = reader.size
+
+    response = current_app.response_class(data, mimetype=doc['mime_type'])
+    response.headers['X-Region-Start'] = str(start)
+    response.headers['X-Region-End'] = str(stop)
+    response.headers['X-Document-Size'] = str(size)
+    return response
+
+
+# Not offloaded, since the first request for a document builds its line
+# index in a full pass over it.
+@app.route('/view/lines')
+def view_lines():
+    """Return count lines of a text document starting at line start
+
+    Lines are numbered from 0. The document's line index is built on
+    the first request and reused until the document changes.
+    """
+    uri = request.args.get('uri')
+    if uri is None:
+        return ('No uri argument specified', 400)
+    start = max(request.args.get('start', 0, type=int), 0)
+    count = request.args.get(
+        'count', current_app.config['VIEW_LINES'], type=int
+    )
+    count = min(max(count, 0), current_app.config['VIEW_LINES_MAX'])
+
+    doc = current_app.stat_document(uri)
+    if doc is None or doc['mime_type'] not in TEXT_DOC_TYPES:
+        return ('Cannot view file', 415)
+
+    with current_app.open_file(uri, 'rb', doc['last_modified']) as f:
+        try:
+            reader = open_reader(f)
+        except ValueError as err:
+            return (str(err), 501)
+
+        with reader:
+            st = os.fstat(f.fileno())
+            index = current_app.get_line_index(uri, reader, st)
+            begin = index.line_offset(reader, start)
+            end = index.line_offset(reader, start + count)
+            data = reader.read(begin, end)
+
+    returned = max(min(count, index.lines - start), 0)
+    response = current_app.response_class(data, mimetype=doc['mime_type'])
+    response.headers['X-Line-Start'] = str(start)
+    response.headers['X-Line-Count'] = str(returned)
+    response.headers['X-Total-Lines'] = str(index.lines)
+    return response
+
+
+@app.route('/view/tail')
+@offload
+def view_tail():
+    """Return the last lines of a text document
+
+    The X-Offset header has the document size, which can be passed as
+    the offset to /view/follow to receive what's appended next.
+    """
+    uri = request.args.get('uri')
+    if uri is None:
+        return ('No uri argument specified', 400)
+    lines = request.args.get('lines', current_app.config['VIEW_LINES'],
+                             type=int)
+    lines = min(max(lines, 0), current_app.config['VIEW_LINES_MAX'])
+
+    doc = current_app.stat_document(uri)
+    if doc is None or doc['mime_type'] not in TEXT_DOC_TYPES:
+        return ('Cannot view file', 415)
+
+    with current_app.open_file(uri, 'rb', doc['last_modified']) as f:
+        try:
+            reader = open_reader(f)
+        except ValueError as err:
+            return (str(err), 501)
+
+        with reader:
+            start = tail_offset(reader, lines)
+            data = reader.read(start, reader.size)
+            size = reader.size
+
+    response = current_app.response_class(data, mimetype=doc['mime_type'])
+    response.headers['X-Offset'] = str(size)
+    return response
+
+
+def follow_events(fd, offset, interval, keepalive, chunk_size):
+    """Generate server-sent events for data appended to a file
+
+    Each event carries complete lines appended after offset, with the
+    offset after them as the event ID so a reconnecting EventSource
+    resumes where it left off. A truncated file restarts from the
+    beginning with a truncated event.
+    """
+    pending = b''
+    idle = 0
+    while True:
+        size = os.fstat(fd).st_size
+        if size < offset:
+            logger.debug('Followed fd %d truncated to %d', fd, size)
+            offset = 0
+            pending = b''
+            yield 'event: truncated\ndata: 0\n\n'
+
+        data = b''
+        if size > offset:
+            data = os.pread(fd, min(size - offset, chunk_size), offset)
+            offset += len(data)
+
+        # Hold back a partial last line unless it's grown too long.
+        pending += data
+        end = pending.rfind(b'\n') + 1
+        if end == 0 and len(pending) >= chunk_size:
+            end = len(pending)
+        if end > 0:
+            # Every line becomes a data field. The client joins them
+            # back together with newlines.
+            text = pending[:end].decode('utf-8', errors='replace')
+            pending = pending[end:]
+            event = ''.join(f'data: {line}\n' for line in text.splitlines())
+            yield f'id: {offset - len(pending)}\n{event}\n'
+            idle = 0
+            if size > offset:
+                continue
+
+        time.sleep(interval)
+        idle += interval
+        if idle >= keepalive:
+            yield ': keepalive\n\n'
+            idle = 0
+
+
+@app.route('/view/follow')
+@offload
+def view_follow():
+    """Stream data appended to a document as server-sent events
+
+    Following starts at offset, the Last-Event-ID of a reconnecting
+    client, or the current end of the document.
+    """
+    uri = request.args.get('uri')
+    if uri is None:
+        return ('No uri argument specified', 400)
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        offset = request.headers.get('Last-Event-ID', type=int)
+
+    doc = current_app.stat_document(uri)
+    if doc is None or doc['mime_type'] not in TEXT_DOC_TYPES:
+        return ('Cannot view file', 415)
+
+    f = current_app.open_file(uri, 'rb', doc['last_modified'])
+    fd = f.fileno()
+    if not stat.S_ISREG(os.fstat(fd).st_mode):
+        f.close()
+        return ('File does not support following', 501)
+    if offset is None:
+        offset = os.fstat(fd).st_size
+
+    config = current_app.config
+    events = follow_events(
+        fd,
+        max(offset, 0),
+        config['FOLLOW_INTERVAL'],
+        config['FOLLOW_KEEPALIVE'],
+        config['FOLLOW_CHUNK'],
+    )
+    response = current_app.response_class(
+        events, mimetype='text/event-stream'
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    response.call_on_close(f.close)
+    return response
@@ -0,0 +1,216 @@
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """Bounded mapping with least recently used eviction
+
+    Entries older than ttl seconds are treated as missing. A ttl of None
+    disables expiry. Hit, miss and eviction counters are kept so the
+    cache can be sized from the stats() output.
+    """
+    def __init__(self, maxsize=128, ttl=None, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and not self._expired(entry)
+
+    def _expired(self, entry):
+        return (
+            self.ttl is not None and
+            time.monotonic() - entry[0] > self.ttl
+        )
+
+    def _evict(self, key, value):
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if self._expired(entry):
+                logger.debug('Cache entry %s expired', key)
+                del self._entries[key]
+                self.misses += 1
+                self._evict(key, entry[1])
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None and old[1] is not value:
+                self._evict(key, old[1])
+            self._entries[key] = (time.monotonic(), value)
+            while len(self._entries) > self.maxsize:
+                old_key, old = self._entries.popitem(last=False)
+                logger.debug('Evicting cache entry %s', old_key)
+                self.evictions += 1
+                self._evict(old_key, old[1])
+
+    def pop(self, key, default=None):
+        """Remove and return the value for key without evicting it"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return default
+            if self._expired(entry):
+                logger.debug('Cache entry %s expired', key)
+                self.misses += 1
+                self._evict(key, entry[1])
+                return default
+            self.hits += 1
+            return entry[1]
+
+    def expire(self):
+        """Evict all expired entries"""
+        if self.ttl is None:
+            return
+        with self._lock:
+            expired = [
+                (key, entry) for key, entry in self._entries.items()
+                if self._expired(entry)
+            ]
+            for key, entry in expired:
+                logger.debug('Cache entry %s expired', key)
+                del self._entries[key]
+                self._evict(key, entry[1])
+
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return False
+            self._evict(key, entry[1])
+            return True
+
+    def clear(self):
+        with self._lock:
+            entries = self._entries
+            self._entries = OrderedDict()
+            for key, entry in entries.items():
+                self._evict(key, entry[1])
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class DiskCache:
+    """Size bounded cache of files in a directory
+
+    Files are named by a hash of their key. Recency is tracked with the
+    file modification times, which are bumped on every hit, so the least
+    recently used files are evicted first even across restarts.
+    """
+    def __init__(self, directory, max_bytes, suffix=''):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, _, size in self._scan())
+
+    def _scan(self):
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(self.suffix):
+                st = entry.stat()
+                yield entry.path, st.st_mtime, st.st_size
+
+    def path(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + self.suffix)
+
+    def get(self, key):
+        """Return the path of the cached file for key or None"""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def temp_path(self, key):
+        """Return a path to write a new file for key to before put()"""
+        return f'{self.path(key)}.{threading.get_ident()}.tmp'
+
+    def put(self, key, temp_path):
+        """Move a file written to temp_path into the cache"""
+        path = self.path(key)
+        size = os.stat(temp_path).st_size
+        with self._lock:
+            try:
+                old_size = os.stat(path).st_size
+            except FileNotFoundError:
+                old_size = 0
+            os.replace(temp_path, path)
+            self._size += size - old_size
+            if self._size > self.max_bytes:
+                self._evict()
+        return path
+
+    def _evict(self):
+        # Trim to 90% of the maximum so eviction doesn't run on every
+        # insertion once the cache is full.
+        target = self.max_bytes * 9 // 10
+        entries = sorted(self._scan(), key=lambda entry: entry[1])
+        self._size = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if self._size <= target:
+                break
+            logger.debug('Evicting cached file %s', path)
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
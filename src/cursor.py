@@ -0,0 +1,195 @@
+"""Bulk reading of Android cursors
+
+Reading a cursor cell by cell costs one JNI call per getString() or
+getLong() plus one per moveToNext(). DatabaseUtils can render a whole
+cursor, or the current row, into a single string on the Java side, so
+the values cross the bridge in one call and are decoded here instead.
+"""
+
+from jnius import autoclass
+import logging
+
+logger = logging.getLogger(__name__)
+
+DatabaseUtils = autoclass('android.database.DatabaseUtils')
+
+# Column types understood by the readers.
+STRING = 'string'
+LONG = 'long'
+
+
+class DumpFormatError(ValueError):
+    pass
+
+
+def _split_row(lines, start, end, position, columns):
+    """Split one dumped row out of lines[start:end]
+
+    Returns the raw string values and the index of the line after the
+    row. Values containing newlines are rejoined by scanning for the
+    next expected column prefix. A value containing a line that looks
+    like any column could have been split in the wrong place, so it's
+    rejected rather than guessed at.
+    """
+    if start >= end or lines[start] != f'{position} {{':
+        raise DumpFormatError(f'Missing header for row {position}')
+    prefixes = tuple(f'   {column}=' for column in columns)
+
+    i = start + 1
+    values = []
+    for n, column in enumerate(columns):
+        prefix = f'   {column}='
+        if i >= end or not lines[i].startswith(prefix):
+            raise DumpFormatError(
+                f'Missing column {column} in row {position}'
+            )
+        parts = [lines[i][len(prefix):]]
+        i += 1
+
+        if n + 1 < len(columns):
+            next_prefix = f'   {columns[n + 1]}='
+            while i < end and not lines[i].startswith(next_prefix):
+                parts.append(lines[i])
+                i += 1
+        else:
+            next_header = f'{position + 1} {{'
+            while i < end and not (
+                lines[i] == '}' and
+                (i + 1 == end or lines[i + 1] == next_header)
+            ):
+                parts.append(lines[i])
+                i += 1
+        if any(part.startswith(prefixes) for part in parts[1:]):
+            raise DumpFormatError(
+                f'Ambiguous value for column {column} in row {position}'
+            )
+        values.append('\n'.join(parts))
+
+    if i >= end or lines[i] != '}':
+        raise DumpFormatError(f'Unterminated row {position}')
+    return values, i + 1
+
+
+def parse_cursor_dump(dump, columns):
+    """Parse DatabaseUtils.dumpCursorToString() output into raw rows"""
+    lines = dump.split('\n')
+    if (
+        len(lines) < 3 or
+        not lines[0].startswith('>>>>> Dumping cursor ') or
+        lines[-2:] != ['<<<<<', '']
+    ):
+        raise DumpFormatError('Unrecognized cursor dump')
+
+    rows = []
+    i = 1
+    end = len(lines) - 2
+    while i < end:
+        values, i = _split_row(lines, i, end, len(rows), columns)
+        rows.append(values)
+    return rows
+
+
+def parse_row_dump(dump, position, columns):
+    """Parse DatabaseUtils.dumpCurrentRowToString() output"""
+    lines = dump.split('\n')
+    if lines[-1:] != ['']:
+        raise DumpFormatError('Unrecognized row dump')
+    end = len(lines) - 1
+    values, i = _split_row(lines, 0, end, position, columns)
+    if i != end:
+        raise DumpFormatError('Trailing data in row dump')
+    return values
+
+
+def _decode(values, types):
+    """Convert raw dumped strings to Python values
+
+    Returns None if the row can't be decoded unambiguously. Null is
+    dumped as the string "null", which is only a problem for string
+    columns since getLong() returns 0 for null anyway.
+    """
+    row = []
+    for value, kind in zip(values, types):
+        if kind == LONG:
+            row.append(0 if value == 'null' else int(value))
+        elif value == 'null':
+            return None
+        else:
+            row.append(value)
+    return row
+
+
+def read_cells(cursor, types):
+    """Read the current row one cell at a time"""
+    row = []
+    for i, kind in enumerate(types):
+        if kind == LONG:
+            row.append(cursor.getLong(i))
+        else:
+            row.append(cursor.getString(i))
+    return row
+
+
+def read_row(cursor, columns, types, position=None):
+    """Read the current row with a single JNI call where possible
+
+    Pass the cursor's position if it's known to save a JNI call.
+    """
+    if position is None:
+        position = cursor.getPosition()
+    try:
+        values = parse_row_dump(
+            DatabaseUtils.dumpCurrentRowToString(cursor), position, columns
+        )
+        row = _decode(values, types)
+    except ValueError as err:
+        logger.debug('Falling back to cell reads for row %d: %s',
+                     position, err)
+        row = None
+    if row is None:
+        row = read_cells(cursor, types)
+    return row
+
+
+def iter_rows(cursor, columns, types, offset=0):
+    """Generate rows from the cursor starting at offset
+
+    Each row costs a moveToNext() and a row dump.
+    """
+    if offset > 0 and not cursor.moveToPosition(offset - 1):
+        return
+    position = offset
+    while cursor.moveToNext():
+        yield read_row(cursor, columns, types, position)
+        position += 1
+
+
+def read_rows(cursor, columns, types):
+    """Read every row of the cursor with a single JNI call where possible
+
+    Rows that can't be decoded from the dump are re-read from the
+    cursor one cell at a time. If the dump can't be parsed at all, the
+    whole cursor is read row by row instead.
+    """
+    try:
+        raw_rows = parse_cursor_dump(
+            DatabaseUtils.dumpCursorToString(cursor), columns
+        )
+        if len(raw_rows) != cursor.getCount():
+            raise DumpFormatError('Row count mismatch')
+    except ValueError as err:
+        logger.warning('Cannot parse cursor dump, reading rows: %s', err)
+        cursor.moveToPosition(-1)
+        return list(iter_rows(cursor, columns, types))
+
+    rows = []
+    for position, values in enumerate(raw_rows):
+        try:
+            row = _decode(values, types)
+        except ValueError:
+            row = None
+        if row is None:
+            cursor.moveToPosition(position)
+            row = read_cells(cursor, types)
+        rows.append(row)
+    return rows
@@ -0,0 +1,337 @@
+"""Persistent SQLite index of document metadata
+
+Directory listings are stored per parent document URI along with the
+time they were listed, so pages can be rendered without a provider
+query and refreshed in the background when they get stale. Document
+names are also indexed by trigram for substring and fuzzy searches.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Document.MIME_TYPE_DIR, duplicated to keep this module free of JNI.
+DIRECTORY_MIME_TYPE = 'vnd.android.document/directory'
+
+# Document fields stored in the index, matching the list_files() keys.
+FIELDS = ('uri', 'id', 'name', 'mime_type', 'size', 'last_modified')
+
+# Bump when the schema changes. The index only caches provider data, so
+# an outdated database is simply dropped and rebuilt.
+SCHEMA_VERSION = 2
+
+SCHEMA = '''
+CREATE TABLE documents (
+    doc INTEGER PRIMARY KEY,
+    uri TEXT NOT NULL UNIQUE,
+    parent TEXT NOT NULL,
+    id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    mime_type TEXT,
+    size INTEGER NOT NULL DEFAULT 0,
+    last_modified INTEGER NOT NULL DEFAULT 0,
+    generation INTEGER NOT NULL DEFAULT 0,
+    -- Name the trigrams were built from.
+    indexed_name TEXT
+);
+CREATE INDEX documents_parent ON documents (parent, mime_type, name);
+CREATE TABLE directories (
+    uri TEXT PRIMARY KEY,
+    tree TEXT NOT NULL,
+    listed REAL NOT NULL,
+    stale INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX directories_tree ON directories (tree);
+CREATE TABLE trigrams (
+    trigram TEXT NOT NULL,
+    doc INTEGER NOT NULL,
+    PRIMARY KEY (trigram, doc)
+) WITHOUT ROWID;
+CREATE INDEX trigrams_doc ON trigrams (doc);
+CREATE TRIGGER documents_delete AFTER DELETE ON documents BEGIN
+    DELETE FROM trigrams WHERE doc = old.doc;
+END;
+'''
+
+
+def trigrams(text):
+    """Return the set of case folded trigrams in text"""
+    text = text.casefold()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class DocumentIndex:
+    def __init__(self, path, max_age=None):
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._generation = time.time_ns()
+        logger.info('Opening document index %s', path)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._create_schema()
+
+    def _create_schema(self):
+        version = self._db.execute('PRAGMA user_version').fetchone()[0]
+        if version == SCHEMA_VERSION:
+            return
+
+        logger.info('Recreating document index with schema version %d',
+                    SCHEMA_VERSION)
+        tables = [
+            row[0] for row in self._db.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )
+        ]
+        script = ''.join(f'DROP TABLE {table};\n' for table in tables)
+        script += SCHEMA
+        script += f'PRAGMA user_version = {SCHEMA_VERSION};\n'
+        self._db.executescript(f'BEGIN;\n{script}COMMIT;\n')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def directory(self, uri):
+        """Return the directory record for uri or None if not indexed
+
+        The record has the tree URI, the time it was listed in seconds
+        since the epoch and whether it's stale. A directory is stale if
+        it has been marked so or was listed more than max_age seconds
+        ago.
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT tree, listed, stale FROM directories WHERE uri = ?',
+                (uri,),
+            ).fetchone()
+        if row is None:
+            return None
+
+        stale = bool(row['stale'])
+        if self.max_age is not None:
+            stale = stale or time.time() - row['listed'] > self.max_age
+        return {
+            'tree': row['tree'],
+            'listed': row['listed'],
+            'stale': stale,
+        }
+
+    def children(self, uri, offset=0, limit=None):
+        """Return indexed children of directory uri
+
+        Entries have the same keys as list_files() entries. Directories
+        sort before files.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                f'SELECT {", ".join(FIELDS)} FROM documents '
+                'WHERE parent = ? '
+                'ORDER BY mime_type != ?, name COLLATE NOCASE '
+                'LIMIT ? OFFSET ?',
+                (uri, DIRECTORY_MIME_TYPE, -1 if limit is None else limit,
+                 offset),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def replace_children(self, tree, uri, entries):
+        """Reconcile the children of directory uri with entries
+
+        entries is an iterable of list_files() entries. It's consumed
+        in batches so a generator keeps memory bounded. The index is
+        only locked while a batch is written, so reads aren't held up
+        while a slow provider produces the entries. Indexed children
+        that aren't in entries are removed once they're all written.
+        """
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+        sql = (
+            f'INSERT INTO documents (parent, generation, {", ".join(FIELDS)}) '
+            f'VALUES (?, ?, {", ".join("?" * len(FIELDS))}) '
+            'ON CONFLICT (uri) DO UPDATE SET '
+            'parent = excluded.parent, '
+            'generation = excluded.generation, ' +
+            ', '.join(
+                f'{field} = excluded.{field}' for field in FIELDS[1:]
+            )
+        )
+
+        count = 0
+        batch = []
+        for entry in entries:
+            batch.append(
+                (uri, generation) + tuple(entry[field] for field in FIELDS)
+            )
+            if len(batch) >= 500:
+                with self._lock, self._db:
+                    self._db.executemany(sql, batch)
+                count += len(batch)
+                batch = []
+
+        with self._lock, self._db:
+            self._db.executemany(sql, batch)
+            count += len(batch)
+
+            removed = self._remove_children(uri, generation)
+            self._index_names(uri)
+            self._db.execute(
+                'INSERT OR REPLACE INTO directories '
+                '(uri, tree, listed, stale) VALUES (?, ?, ?, 0)',
+                (uri, tree, time.time()),
+            )
+        logger.debug('Indexed %d documents in %s, removed %d',
+                     count, uri, removed)
+
+    def _index_names(self, uri):
+        """Build trigrams for new and renamed children of uri"""
+        rows = self._db.execute(
+            'SELECT doc, name, indexed_name FROM documents '
+            'WHERE parent = ? AND indexed_name IS NOT name',
+            (uri,),
+        ).fetchall()
+        self._db.executemany(
+            'DELETE FROM trigrams WHERE doc = ?',
+            ((row['doc'],) for row in rows if row['indexed_name'] is not None),
+        )
+        self._db.executemany(
+            'INSERT INTO trigrams (trigram, doc) VALUES (?, ?)',
+            (
+                (trigram, row['doc'])
+                for row in rows
+                for trigram in trigrams(row['name'])
+            ),
+        )
+        self._db.executemany(
+            'UPDATE documents SET indexed_name = ? WHERE doc = ?',
+            ((row['name'], row['doc']) for row in rows),
+        )
+
+    def _remove_children(self, uri, generation):
+        """Delete children of uri not seen in the given generation
+
+        Removed subdirectories take their indexed descendants with them.
+        """
+        rows = self._db.execute(
+            'SELECT uri, mime_type FROM documents '
+            'WHERE parent = ? AND generation != ?',
+            (uri, generation),
+        ).fetchall()
+        self._db.execute(
+            'DELETE FROM documents WHERE parent = ? AND generation != ?',
+            (uri, generation),
+        )
+
+        directories = [
+            row['uri'] for row in rows
+            if row['mime_type'] == DIRECTORY_MIME_TYPE
+        ]
+        while directories:
+            directory = directories.pop()
+            self._db.execute(
+                'DELETE FROM directories WHERE uri = ?', (directory,)
+            )
+            directories.extend(
+                row['uri'] for row in self._db.execute(
+                    'SELECT uri FROM documents '
+                    'WHERE parent = ? AND mime_type = ?',
+                    (directory, DIRECTORY_MIME_TYPE),
+                )
+            )
+            self._db.execute(
+                'DELETE FROM documents WHERE parent = ?', (directory,)
+            )
+        return len(rows)
+
+    def mark_stale(self, uri):
+        with self._lock, self._db:
+            self._db.execute(
+                'UPDATE directories SET stale = 1 WHERE uri = ?', (uri,)
+            )
+
+    def search(self, tree, query, fuzzy=False, limit=50):
+        """Search document names in tree
+
+        By default, documents whose name contains query ignoring case
+        are returned. With fuzzy, documents sharing enough trigrams with
+        query are returned with the most similar first.
+        """
+        query = query.casefold()
+        query_trigrams = trigrams(query)
+        if not query_trigrams:
+            # Too short for the trigram index.
+            return self._scan(tree, query, limit)
+
+        columns = ', '.join(f'd.{field}' for field in FIELDS)
+        if fuzzy:
+            # Candidates need at least half the query trigrams. They're
+            # then ranked by the Jaccard similarity of their trigrams.
+            minimum = max(1, len(query_trigrams) // 2)
+            candidate_limit = limit * 4
+        else:
+            minimum = len(query_trigrams)
+            candidate_limit = -1
+
+        placeholders = ', '.join('?' * len(query_trigrams))
+        sql = (
+            f'SELECT {columns}, t.shared FROM ('
+            '    SELECT doc, COUNT(*) AS shared FROM trigrams '
+            f'    WHERE trigram IN ({placeholders}) '
+            '    GROUP BY doc HAVING shared >= ? '
+            ') AS t '
+            'JOIN documents AS d ON d.doc = t.doc '
+            'JOIN directories AS p ON p.uri = d.parent '
+            'WHERE p.tree = ? '
+            'ORDER BY t.shared DESC '
+            'LIMIT ?'
+        )
+        params = (*query_trigrams, minimum, tree, candidate_limit)
+
+        results = []
+        with self._lock:
+            cursor = self._db.execute(sql, params)
+            if not fuzzy:
+                # Sharing every trigram doesn't guarantee a substring
+                # match, so check the candidates.
+                for row in cursor:
+                    if query in row['name'].casefold():
+                        results.append(self._result(row))
+                        if len(results) >= limit:
+                            break
+                return results
+            rows = cursor.fetchall()
+
+        for row in rows:
+            name_trigrams = trigrams(row['name'])
+            union = len(query_trigrams) + len(name_trigrams) - row['shared']
+            result = self._result(row)
+            result['score'] = row['shared'] / union if union else 0
+            results.append(result)
+        results.sort(key=lambda result: result['score'], reverse=True)
+        return results[:limit]
+
+    def _scan(self, tree, query, limit):
+        results = []
+        columns = ', '.join(f'd.{field}' for field in FIELDS)
+        with self._lock:
+            cursor = self._db.execute(
+                f'SELECT {columns} FROM documents AS d '
+                'JOIN directories AS p ON p.uri = d.parent '
+                'WHERE p.tree = ?',
+                (tree,),
+            )
+            for row in cursor:
+                if query in row['name'].casefold():
+                    results.append(self._result(row))
+                    if len(results) >= limit:
+                        break
+        return results
+
+    @staticmethod
+    def _result(row):
+        return {field: row[field] for field in FIELDS}
@@ -0,0 +1,133 @@
+"""Pool of open read-only file descriptors
+
+Opening a document goes through the provider, which is far slower than
+reading it. Descriptors of documents that are read repeatedly, such as
+by paged views and Range requests, are kept open while idle and handed
+out again instead of reopening the document.
+"""
+
+from cache import LRUCache
+import io
+import logging
+import os
+import stat
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PooledFileIO(io.FileIO):
+    """Unbuffered file that returns its descriptor to the pool on close"""
+    def __init__(self, pool, key, fd, last_modified):
+        super().__init__(fd, 'rb', closefd=False)
+        self._pool = pool
+        self._key = key
+        self._fd = fd
+        self._last_modified = last_modified
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            super().close()
+        finally:
+            self._pool.release(self._key, self._fd, self._last_modified)
+
+
+class PooledFile(io.BufferedReader):
+    """Buffered reader that returns its descriptor to the pool on close"""
+    def __init__(self, pool, key, fd, last_modified,
+                 buffer_size=io.DEFAULT_BUFFER_SIZE):
+        super().__init__(
+            PooledFileIO(pool, key, fd, last_modified), buffer_size
+        )
+
+
+class FilePool:
+    """LRU pool of idle read-only descriptors keyed by document URI
+
+    opener is called with a URI and returns a new read-only descriptor.
+    At most maxsize idle descriptors are kept, each for at most
+    idle_timeout seconds. Idle descriptors are closed on a timer so
+    they don't keep documents or storage busy once browsing stops.
+
+    A descriptor is only reused for the same last_modified it was
+    opened for, so a document replaced since is opened again. Only
+    regular files are pooled since pipes can't be rewound.
+    """
+    def __init__(self, opener, maxsize=16, idle_timeout=30):
+        self.opener = opener
+        self.idle_timeout = idle_timeout
+        self._idle = LRUCache(
+            maxsize=maxsize,
+            ttl=idle_timeout,
+            on_evict=self._close,
+        )
+        self._timer = None
+        self._timer_lock = threading.Lock()
+
+    @staticmethod
+    def _close(key, value):
+        fd, _ = value
+        logger.debug('Closing pooled fd %d for %s', fd, key)
+        os.close(fd)
+
+    def _expire(self):
+        with self._timer_lock:
+            self._timer = None
+        self._idle.expire()
+        self._schedule_expiry()
+
+    def _schedule_expiry(self):
+        with self._timer_lock:
+            if self._timer is not None or len(self._idle) == 0:
+                return
+            self._timer = threading.Timer(self.idle_timeout, self._expire)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def open(self, uri, last_modified, buffering=io.DEFAULT_BUFFER_SIZE):
+        """Return a pooled file for uri, reusing an idle descriptor
+
+        With buffering 0, the file is an unbuffered PooledFileIO.
+        Otherwise it's a PooledFile with a buffer of that size.
+        """
+        fd = None
+        idle = self._idle.pop(uri)
+        if idle is not None:
+            fd, idle_last_modified = idle
+            if last_modified != idle_last_modified:
+                logger.debug('Document %s changed, reopening', uri)
+                self._close(uri, idle)
+                fd = None
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+        if fd is None:
+            fd = self.opener(uri)
+        if buffering == 0:
+            return PooledFileIO(self, uri, fd, last_modified)
+        return PooledFile(self, uri, fd, last_modified, buffering)
+
+    def release(self, uri, fd, last_modified):
+        """Return a descriptor to the pool or close it"""
+        try:
+            poolable = stat.S_ISREG(os.fstat(fd).st_mode)
+        except OSError:
+            poolable = False
+        if not poolable:
+            os.close(fd)
+            return
+        # A descriptor already idle for uri is closed in favor of this
+        # more recent one.
+        self._idle.put(uri, (fd, last_modified))
+        self._schedule_expiry()
+
+    def invalidate(self, uri):
+        """Close the idle descriptor for uri"""
+        self._idle.invalidate(uri)
+
+    def clear(self):
+        self._idle.clear()
+
+    def stats(self):
+        return self._idle.stats()
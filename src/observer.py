@@ -0,0 +1,109 @@
+"""Directory change notifications
+
+ContentObserver is abstract, so the app ships a small Java subclass that
+forwards notifications to a Python implemented listener interface.
+"""
+
+from cache import LRUCache
+from jnius import PythonJavaClass, autoclass, java_method
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+PythonContentObserver = autoclass(
+    'org.dbnicholson.saftest.PythonContentObserver'
+)
+
+
+class ChangeListener(PythonJavaClass):
+    __javainterfaces__ = [
+        'org/dbnicholson/saftest/PythonContentObserver$Listener',
+    ]
+    __javacontext__ = 'app'
+
+    def __init__(self, callback):
+        super().__init__()
+        self.callback = callback
+
+    @java_method('(ZLandroid/net/Uri;)V')
+    def onChange(self, self_change, uri):
+        try:
+            self.callback()
+        except Exception:
+            logger.exception('Change callback failed')
+
+
+class DirectoryWatcher:
+    """Watch directories with ContentObserver registrations
+
+    At most limit directories are watched, with the least recently
+    watched unregistered first. Notifications for a directory are
+    coalesced so that a burst of changes within delay seconds of the
+    first results in a single callback with the directory key.
+    """
+    def __init__(self, content_resolver, callback, limit=64, delay=1.0):
+        self.content_resolver = content_resolver
+        self.callback = callback
+        self.delay = delay
+        self._observers = LRUCache(maxsize=limit, on_evict=self._unregister)
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._observers)
+
+    def __contains__(self, key):
+        return key in self._observers
+
+    def watch(self, key, uri):
+        """Watch uri for changes, reporting them as key
+
+        With uri None, key is recorded as watched without an observer,
+        for directories whose provider doesn't notify changes.
+        """
+        if self._observers.get(key) is not None:
+            return
+
+        if uri is None:
+            self._observers.put(key, (None, None))
+            return
+
+        logger.debug('Watching %s for changes', key)
+        listener = ChangeListener(lambda: self._notify(key))
+        observer = PythonContentObserver(None, listener)
+        self.content_resolver.registerContentObserver(uri, False, observer)
+        # The listener is kept with the observer since pyjnius requires
+        # the Python object to outlive its Java proxy.
+        self._observers.put(key, (observer, listener))
+
+    def unwatch(self, key):
+        return self._observers.invalidate(key)
+
+    def clear(self):
+        self._observers.clear()
+
+    def _unregister(self, key, value):
+        logger.debug('No longer watching %s', key)
+        observer, _ = value
+        if observer is not None:
+            self.content_resolver.unregisterContentObserver(observer)
+
+    def _notify(self, key):
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+
+        logger.debug('Got change notification for %s', key)
+        timer = threading.Timer(self.delay, self._fire, (key,))
+        timer.daemon = True
+        timer.start()
+
+    def _fire(self, key):
+        with self._lock:
+            self._pending.discard(key)
+        try:
+            self.callback(key)
+        except Exception:
+            logger.exception('Failed to handle change of %s', key)
@@ -0,0 +1,56 @@
+"""Awaiting blocking work on the app's JNI executor
+
+Async views run on the server's request threads, which come and go
+with each connection. Provider queries and other JNI calls are handed
+to the app's jni_executor instead. That's a fixed pool of long lived
+threads that attach to the JVM once, and the view awaits the result.
+The request and app contexts are copied into the worker, so the
+offloaded code can use request and current_app as usual.
+
+Flask runs async views with asgiref, which has to be installed.
+"""
+
+import asyncio
+from concurrent.futures import TimeoutError
+import contextvars
+from flask import current_app
+from functools import partial, wraps
+
+
+async def run_jni(func, *args, **kwargs):
+    """Run func on the JNI executor and return its result"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        current_app.jni_executor,
+        partial(context.run, func, *args, **kwargs),
+    )
+
+
+async def wait_future(future, timeout=None):
+    """Await a concurrent.futures.Future without blocking the thread
+
+    Unlike asyncio.wait_for(), a timeout doesn't cancel the future, so
+    work shared with other requests carries on. As with
+    Future.result(), concurrent.futures.TimeoutError is raised if it
+    isn't done in time.
+    """
+    try:
+        return await asyncio.wait_for(
+            asyncio.shield(asyncio.wrap_future(future)), timeout
+        )
+    except asyncio.TimeoutError:
+        raise TimeoutError from None
+
+
+def offload(view):
+    """Turn a blocking view into an async view run on the JNI executor
+
+    Only use this for views that return quickly. Streamed response
+    bodies are still iterated on the request thread, so long transfers
+    don't hold a JNI worker.
+    """
+    @wraps(view)
+    async def wrapper(*args, **kwargs):
+        return await run_jni(view, *args, **kwargs)
+    return wrapper
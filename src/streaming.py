@@ -0,0 +1,97 @@
+"""Streaming documents to the client
+
+Documents are sent in chunks so memory use doesn't grow with their
+size. Regular files support conditional and Range requests and can be
+sent with sendfile() so the data never passes through Python.
+"""
+
+from flask import current_app, request
+import logging
+import os
+import stat
+from werkzeug.exceptions import HTTPException
+from werkzeug.wsgi import wrap_file
+
+logger = logging.getLogger(__name__)
+
+
+class SendfileBody:
+    """Response body sending a file region straight to the client socket
+
+    The empty first chunk makes the server send the status and headers
+    before the body is written to the socket with socket.sendfile(),
+    which uses os.sendfile() so the data never passes through Python.
+    socket.sendfile() falls back to reads and sends where sendfile()
+    can't be used. The file is closed when the response is closed.
+    """
+    def __init__(self, sock, f, offset, count):
+        self.sock = sock
+        self.f = f
+        self.offset = offset
+        self.count = count
+
+    def __iter__(self):
+        yield b''
+        if self.count > 0:
+            sent = self.sock.sendfile(self.f, self.offset, self.count)
+            logger.debug('Sent %d bytes of fd %d', sent, self.f.fileno())
+
+    def close(self):
+        self.f.close()
+
+
+def stream_file(f, mimetype):
+    """Create a response streaming an open file in chunks
+
+    The file is closed when the response is closed. Memory use is bound
+    by VIEW_CHUNK_SIZE regardless of the file size. Regular files
+    support conditional and Range requests, including If-Range, and are
+    sent with sendfile() when VIEW_SENDFILE is enabled and the server
+    exposes its socket.
+    """
+    chunk_size = current_app.config['VIEW_CHUNK_SIZE']
+    response = current_app.response_class(
+        wrap_file(request.environ, f, chunk_size),
+        mimetype=mimetype,
+        direct_passthrough=True,
+    )
+
+    # Virtual documents can be backed by a pipe with no known size or
+    # seeking, in which case the response is sent chunked in full.
+    st = os.fstat(f.fileno())
+    if not stat.S_ISREG(st.st_mode):
+        return response
+
+    response.content_length = st.st_size
+    response.last_modified = st.st_mtime
+    response.set_etag(f'{st.st_size:x}-{st.st_mtime_ns:x}')
+    # Werkzeug seeks the wrapped file to the start of the range and
+    # stops reading at its end. It doesn't support multiple ranges, so
+    # those requests get the full document instead.
+    ranges = request.range
+    accept_ranges = ranges is None or len(ranges.ranges) == 1
+    try:
+        response.make_conditional(
+            request,
+            accept_ranges=accept_ranges,
+            complete_length=st.st_size,
+        )
+    except HTTPException:
+        response.close()
+        raise
+
+    sock = request.environ.get('werkzeug.socket')
+    if (
+        current_app.config['VIEW_SENDFILE'] and
+        sock is not None and
+        response.status_code in (200, 206)
+    ):
+        if response.status_code == 206:
+            start = response.content_range.start
+            count = response.content_range.stop - start
+        else:
+            start = 0
+            count = st.st_size
+        response.response = SendfileBody(sock, f, start, count)
+
+    return response
@@ -0,0 +1,230 @@
+"""Random access to large text documents
+
+Regular files are memory mapped so arbitrary regions can be sliced and
+searched without reading everything before them. Descriptors that can't
+be mapped fall back to seeking and reading in chunks.
+"""
+
+from bisect import bisect_left
+import logging
+import mmap
+import os
+import stat
+
+logger = logging.getLogger(__name__)
+
+# Chunk size used when scanning unmapped files.
+CHUNK_SIZE = 256 * 1024
+
+# Bytes per checkpoint in a LineIndex.
+LINE_INDEX_BLOCK_SIZE = 64 * 1024
+
+
+class DocumentReader:
+    """Base class for random access document readers
+
+    Subclasses provide size, read(), find() and rfind(). Offsets are in bytes.
+    """
+    size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        pass
+
+    def _clamp(self, offset):
+        return min(max(offset, 0), self.size)
+
+    def read(self, start, stop):
+        raise NotImplementedError
+
+    def find(self, sub, start=0, stop=None):
+        raise NotImplementedError
+
+    def rfind(self, sub, start=0, stop=None):
+        raise NotImplementedError
+
+    def line_start(self, offset):
+        """Return the offset of the start of the line containing offset"""
+        offset = self._clamp(offset)
+        if offset == 0:
+            return 0
+        return self.rfind(b'\n', 0, offset) + 1
+
+    def line_end(self, offset):
+        """Return the offset just past the end of the line at offset"""
+        offset = self._clamp(offset)
+        end = self.find(b'\n', offset)
+        return self.size if end < 0 else end + 1
+
+    def region(self, start, stop):
+        """Return the offsets of the whole lines overlapping start:stop"""
+        start = self.line_start(start)
+        stop = self._clamp(stop)
+        if stop > start and self.read(stop - 1, stop) != b'\n':
+            stop = self.line_end(stop)
+        return start, stop
+
+
+class MappedReader(DocumentReader):
+    def __init__(self, f):
+        self.size = os.fstat(f.fileno()).st_size
+        self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        self._map.close()
+
+    def read(self, start, stop):
+        return self._map[self._clamp(start):self._clamp(stop)]
+
+    def _bounds(self, start, stop):
+        stop = self.size if stop is None else self._clamp(stop)
+        return self._clamp(start), stop
+
+    def find(self, sub, start=0, stop=None):
+        return self._map.find(sub, *self._bounds(start, stop))
+
+    def rfind(self, sub, start=0, stop=None):
+        return self._map.rfind(sub, *self._bounds(start, stop))
+
+
+class BufferedReader(DocumentReader):
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.size = f.seek(0, os.SEEK_END)
+
+    def read(self, start, stop):
+        start = self._clamp(start)
+        stop = self._clamp(stop)
+        if stop <= start:
+            return b''
+        self.f.seek(start)
+        return self.f.read(stop - start)
+
+    def find(self, sub, start=0, stop=None):
+        stop = self.size if stop is None else self._clamp(stop)
+        pos = self._clamp(start)
+        # Chunks overlap so matches spanning a boundary aren't missed.
+        while pos < stop:
+            chunk_stop = min(pos + self.chunk_size + len(sub) - 1, stop)
+            index = self.read(pos, chunk_stop).find(sub)
+            if index >= 0:
+                return pos + index
+            pos += self.chunk_size
+        return -1
+
+    def rfind(self, sub, start=0, stop=None):
+        start = self._clamp(start)
+        stop = self.size if stop is None else self._clamp(stop)
+        pos = stop
+        while pos > start:
+            chunk_start = max(pos - self.chunk_size, start)
+            chunk_stop = min(pos + len(sub) - 1, stop)
+            index = self.read(chunk_start, chunk_stop).rfind(sub)
+            if index >= 0:
+                return chunk_start + index
+            pos = chunk_start
+        return -1
+
+
+class LineIndex:
+    """Sparse index of line offsets
+
+    The document is split into fixed size blocks and the number of
+    newlines before each block is recorded in a single streaming pass.
+    Finding the offset of line n is a binary search of the blocks and a
+    scan of at most one block.
+    """
+    def __init__(self, size, lines, newlines,
+                 block_size=LINE_INDEX_BLOCK_SIZE):
+        self.size = size
+        self.lines = lines
+        self.newlines = newlines
+        self.block_size = block_size
+
+    @classmethod
+    def build(cls, reader, block_size=LINE_INDEX_BLOCK_SIZE):
+        newlines = []
+        count = 0
+        for start in range(0, reader.size, block_size):
+            newlines.append(count)
+            count += reader.read(start, start + block_size).count(b'\n')
+        newlines.append(count)
+
+        # A final line without a trailing newline still counts.
+        lines = count
+        last = reader.read(reader.size - 1, reader.size)
+        if last and last != b'\n':
+            lines += 1
+        return cls(reader.size, lines, newlines, block_size)
+
+    def line_offset(self, reader, n):
+        """Return the byte offset of the start of line n
+
+        Lines are numbered from 0. Offsets past the last line return the
+        document size.
+        """
+        if n <= 0:
+            return 0
+        if n > self.newlines[-1]:
+            return self.size
+
+        # Block k holds the nth newline when newlines[k] < n and
+        # newlines[k + 1] >= n.
+        block = bisect_left(self.newlines, n) - 1
+        pos = block * self.block_size - 1
+        for _ in range(n - self.newlines[block]):
+            pos = reader.find(b'\n', pos + 1)
+        return pos + 1
+
+
+def tail_offset(reader, n, chunk_size=CHUNK_SIZE):
+    """Return the offset of the start of the last n lines
+
+    The document is read backwards from the end in chunks, so only the
+    tail is read. A trailing newline doesn't start another line.
+    """
+    end = reader.size
+    if n <= 0:
+        return end
+    if reader.read(end - 1, end) == b'\n':
+        end -= 1
+
+    remaining = n
+    pos = end
+    while pos > 0:
+        start = max(pos - chunk_size, 0)
+        chunk = reader.read(start, pos)
+        count = chunk.count(b'\n')
+        if count >= remaining:
+            index = len(chunk)
+            for _ in range(remaining):
+                index = chunk.rfind(b'\n', 0, index)
+            return start + index + 1
+        remaining -= count
+        pos = start
+    return 0
+
+
+def open_reader(f):
+    """Return a random access reader for an open binary file
+
+    Non-empty regular files are memory mapped. Other seekable files are
+    read in chunks. A ValueError is raised for unseekable files such as
+    pipes.
+    """
+    st = os.fstat(f.fileno())
+    if stat.S_ISREG(st.st_mode) and st.st_size > 0:
+        try:
+            return MappedReader(f)
+        except (OSError, ValueError) as err:
+            logger.debug('Cannot map fd %d: %s', f.fileno(), err)
+
+    if not f.seekable():
+        raise ValueError('File does not support random access')
+    return BufferedReader(f)
@@ -0,0 +1,70 @@
+"""Pipelined copying between file descriptors
+
+Reads and writes of different documents block on different providers
+or devices, so overlapping them keeps both busy. A reader thread fills
+buffers from a small fixed pool while the calling thread writes the
+filled ones out, so memory use is bound by the pool regardless of the
+document size.
+"""
+
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Size of each pooled buffer.
+CHUNK_SIZE = 1024 * 1024
+
+# Number of pooled buffers. The reader can get this many chunks ahead
+# of the writer.
+BUFFERS = 4
+
+
+def pipe_copy(src, dst, chunk_size=CHUNK_SIZE, buffers=BUFFERS):
+    """Copy everything from src to dst and return the number of bytes
+
+    src must support readinto() and dst write(), such as files opened
+    unbuffered. Errors from either side are raised in the caller.
+    """
+    free = queue.Queue()
+    for _ in range(max(buffers, 1)):
+        free.put(bytearray(chunk_size))
+    filled = queue.Queue()
+    stop = threading.Event()
+
+    def read():
+        try:
+            while True:
+                buf = free.get()
+                if stop.is_set():
+                    break
+                n = src.readinto(buf)
+                filled.put((buf, n))
+                if not n:
+                    break
+        except BaseException as err:
+            filled.put((None, err))
+
+    reader = threading.Thread(target=read, name='copy-reader', daemon=True)
+    reader.start()
+    total = 0
+    try:
+        while True:
+            buf, n = filled.get()
+            if buf is None:
+                raise n
+            if not n:
+                break
+            with memoryview(buf) as view:
+                written = 0
+                while written < n:
+                    written += dst.write(view[written:n])
+            total += n
+            free.put(buf)
+    finally:
+        # Wake the reader if it's waiting for a buffer so it can exit.
+        stop.set()
+        free.put(bytearray(0))
+        reader.join()
+    return total
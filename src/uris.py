@@ -0,0 +1,135 @@
+"""Pure Python versions of DocumentsContract URI helpers
+
+These follow the encoding rules of android.net.Uri so the strings match
+what the Java implementations produce without a JNI round trip per
+document.
+"""
+
+from urllib.parse import quote
+
+PATH_TREE = 'tree'
+PATH_DOCUMENT = 'document'
+
+# Characters Uri.encode() leaves alone besides ASCII letters and digits.
+_UNRESERVED = "_-!.~'()*"
+
+_HEX_DIGITS = frozenset('0123456789abcdefABCDEF')
+
+
+def encode(value):
+    """Equivalent of Uri.encode()"""
+    # Uri.encode() converts with String.getBytes(UTF_8), which replaces
+    # unpaired surrogates with '?'.
+    return quote(value, safe=_UNRESERVED, encoding='utf-8', errors='replace')
+
+
+def decode(value):
+    """Equivalent of Uri.decode()
+
+    Unlike unquote(), malformed escapes such as %zz are replaced with
+    U+FFFD the way Uri.decode() does rather than left alone. The
+    replacement consumes the % and the characters read up to and
+    including the first one that isn't a hex digit.
+    """
+    if '%' not in value:
+        return value
+    parts = []
+    buf = bytearray()
+    i = 0
+    length = len(value)
+    while i < length:
+        c = value[i]
+        if c != '%':
+            if buf:
+                parts.append(buf.decode('utf-8', errors='replace'))
+                buf.clear()
+            parts.append(c)
+            i += 1
+            continue
+
+        digits = value[i + 1:i + 3]
+        if len(digits) == 2 and all(d in _HEX_DIGITS for d in digits):
+            buf.append(int(digits, 16))
+            i += 3
+            continue
+
+        if buf:
+            parts.append(buf.decode('utf-8', errors='replace'))
+            buf.clear()
+        parts.append('\ufffd')
+        # Skip the % and the hex digits before the offending character,
+        # then the offending character itself.
+        i += 1
+        while i < length and value[i] in _HEX_DIGITS:
+            i += 1
+        i += 1
+    if buf:
+        parts.append(buf.decode('utf-8', errors='replace'))
+    return ''.join(parts)
+
+
+def split_uri(uri):
+    """Split a URI string into scheme, encoded authority and path segments
+
+    Path segments are decoded and empty segments are dropped, matching
+    Uri.getPathSegments().
+    """
+    scheme, sep, rest = uri.partition(':')
+    if not sep:
+        raise ValueError(f'URI {uri} has no scheme')
+    rest = rest.split('#', 1)[0].split('?', 1)[0]
+    authority = ''
+    if rest.startswith('//'):
+        rest = rest[2:]
+        slash = rest.find('/')
+        if slash < 0:
+            authority, rest = rest, ''
+        else:
+            authority, rest = rest[:slash], rest[slash:]
+    segments = [decode(segment) for segment in rest.split('/') if segment]
+    return scheme, authority, segments
+
+
+def get_tree_document_id(tree_uri):
+    """Equivalent of DocumentsContract.getTreeDocumentId()"""
+    _, _, segments = split_uri(tree_uri)
+    if len(segments) >= 2 and segments[0] == PATH_TREE:
+        return segments[1]
+    raise ValueError(f'Invalid URI: {tree_uri}')
+
+
+def get_document_id(document_uri):
+    """Equivalent of DocumentsContract.getDocumentId()"""
+    _, _, segments = split_uri(document_uri)
+    if len(segments) >= 2 and segments[0] == PATH_DOCUMENT:
+        return segments[1]
+    if (
+        len(segments) >= 4 and
+        segments[0] == PATH_TREE and
+        segments[2] == PATH_DOCUMENT
+    ):
+        return segments[3]
+    raise ValueError(f'Invalid URI: {document_uri}')
+
+
+def build_tree_uri(uri):
+    """Return the tree URI a tree or tree document URI belongs to
+
+    Equivalent of DocumentsContract.buildTreeDocumentUri() with the
+    authority and tree document ID of uri.
+    """
+    _, authority, _ = split_uri(uri)
+    tree_id = get_tree_document_id(uri)
+    return (
+        f'content://{encode(decode(authority))}/{PATH_TREE}/'
+        f'{encode(tree_id)}'
+    )
+
+
+def document_uri_prefix(tree_uri):
+    """Return the part of a tree document URI before the document ID
+
+    Appending encode(document_id) to the prefix gives the same string as
+    DocumentsContract.buildDocumentUriUsingTree(tree_uri, document_id).
+    """
+    return f'{build_tree_uri(tree_uri)}/{PATH_DOCUMENT}/'
@@ -0,0 +1,91 @@
+"""Streaming ZIP archives
+
+zipfile can write to a stream that doesn't support seeking or telling
+by putting each member's sizes and CRC in a data descriptor after its
+data. The archive is written to a sink that collects the output, which
+is handed out as soon as it's produced, so an archive of any size can
+be sent while it's built using only a chunk of memory.
+"""
+
+import logging
+import time
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+# Chunk size members are copied into the archive in.
+CHUNK_SIZE = 256 * 1024
+
+# Earliest time a ZIP member can have, 1980-01-01.
+_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+
+class ZipSink:
+    """Write only file object that buffers data until it's drained"""
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        # zipfile may pass a memoryview of a buffer it reuses.
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """Return and forget the data written since the last drain"""
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def date_time(last_modified):
+    """Return a ZIP date_time tuple for a time in ms since the epoch"""
+    if not last_modified:
+        return _EPOCH
+    return max(time.localtime(last_modified / 1000)[:6], _EPOCH)
+
+
+def iter_zip(members, compression=zipfile.ZIP_STORED,
+             chunk_size=CHUNK_SIZE):
+    """Generate the bytes of a ZIP archive of members
+
+    members is an iterable of (name, last_modified, size, opener)
+    tuples. Names ending in / are directories and their opener is
+    ignored. Otherwise opener is a callable returning a binary file
+    object, which is read in chunk_size pieces and closed. The size is
+    used to decide whether a member needs ZIP64 extensions before its
+    data is read. Members whose opener raises OSError are skipped.
+    """
+    sink = ZipSink()
+    with zipfile.ZipFile(sink, 'w', compression) as zf:
+        for name, last_modified, size, opener in members:
+            info = zipfile.ZipInfo(name, date_time(last_modified))
+            if name.endswith('/'):
+                # Directory with drwxr-xr-x permissions.
+                info.external_attr = 0o40755 << 16 | 0x10
+                zf.writestr(info, b'')
+                continue
+
+            info.compress_type = compression
+            info.external_attr = 0o100644 << 16
+            info.file_size = size
+            try:
+                src = opener()
+            except OSError as err:
+                logger.warning('Skipping %s: %s', name, err)
+                continue
+            with src, zf.open(info, 'w') as dest:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
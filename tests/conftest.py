@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The app modules live in src and are imported by their bare names on
+# the device, so make them importable the same way here.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
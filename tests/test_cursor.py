@@ -0,0 +1,179 @@
+"""Tests of the cursor dump parser and readers
+
+The readers are run against a Python cursor that renders dumps the way
+android.database.DatabaseUtils does and counts the calls that would
+cross the JNI bridge on a device.
+"""
+
+import sys
+import types
+
+import pytest
+
+# cursor looks up DatabaseUtils at import time, so provide it before
+# importing.
+_jnius = types.ModuleType('jnius')
+
+
+class DatabaseUtils:
+    @staticmethod
+    def dumpCursorToString(cursor):
+        cursor.calls += 1
+        lines = [f'>>>>> Dumping cursor {cursor!r}']
+        for position in range(len(cursor.rows)):
+            lines.extend(cursor.row_lines(position))
+        lines.append('<<<<<')
+        return ''.join(f'{line}\n' for line in lines)
+
+    @staticmethod
+    def dumpCurrentRowToString(cursor):
+        cursor.calls += 1
+        lines = cursor.row_lines(cursor.position)
+        return ''.join(f'{line}\n' for line in lines)
+
+
+_jnius.autoclass = lambda name: DatabaseUtils
+sys.modules.setdefault('jnius', _jnius)
+
+import cursor  # noqa: E402
+from cursor import LONG, STRING  # noqa: E402
+
+COLUMNS = ['_display_name', 'document_id', 'last_modified', '_size']
+TYPES = [STRING, STRING, LONG, LONG]
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.position = -1
+        self.calls = 0
+
+    def row_lines(self, position):
+        lines = [f'{position} {{']
+        for column, value in zip(COLUMNS, self.rows[position]):
+            lines.append(f'   {column}={"null" if value is None else value}')
+        lines.append('}')
+        return lines
+
+    def getCount(self):
+        self.calls += 1
+        return len(self.rows)
+
+    def getPosition(self):
+        self.calls += 1
+        return self.position
+
+    def moveToNext(self):
+        self.calls += 1
+        if self.position + 1 >= len(self.rows):
+            self.position = len(self.rows)
+            return False
+        self.position += 1
+        return True
+
+    def moveToPosition(self, position):
+        self.calls += 1
+        self.position = position
+        return -1 <= position < len(self.rows)
+
+    def getString(self, i):
+        self.calls += 1
+        return self.rows[self.position][i]
+
+    def getLong(self, i):
+        self.calls += 1
+        value = self.rows[self.position][i]
+        return 0 if value is None else value
+
+
+def make_rows(count):
+    return [
+        [f'file{i}.txt', f'primary:file{i}.txt', 1700000000000 + i, i]
+        for i in range(count)
+    ]
+
+
+def test_read_rows():
+    rows = make_rows(5)
+    assert cursor.read_rows(FakeCursor(rows), COLUMNS, TYPES) == rows
+
+
+def test_iter_rows_offset():
+    rows = make_rows(5)
+    result = list(cursor.iter_rows(FakeCursor(rows), COLUMNS, TYPES, 3))
+    assert result == rows[3:]
+
+
+def test_multiline_value():
+    rows = make_rows(3)
+    rows[1][0] = 'first\nsecond\n}\n2 {'
+    assert cursor.read_rows(FakeCursor(rows), COLUMNS, TYPES) == rows
+    assert list(cursor.iter_rows(FakeCursor(rows), COLUMNS, TYPES)) == rows
+
+
+def test_null_string_falls_back_to_cells():
+    rows = make_rows(3)
+    rows[1][0] = None
+    c = FakeCursor(rows)
+    assert cursor.read_rows(c, COLUMNS, TYPES) == rows
+
+
+def test_literal_null_string():
+    rows = make_rows(2)
+    rows[0][0] = 'null'
+    assert cursor.read_rows(FakeCursor(rows), COLUMNS, TYPES) == rows
+
+
+@pytest.mark.parametrize('name', [
+    'a\n   document_id=evil',
+    'a\n   _size=1',
+    'a\n   _display_name=b',
+    'a\n   document_id=evil\n   last_modified=1\n   _size=2\n}\n1 {',
+])
+def test_injected_column_is_not_misparsed(name):
+    rows = make_rows(3)
+    rows[1][0] = name
+    assert cursor.read_rows(FakeCursor(rows), COLUMNS, TYPES) == rows
+    assert list(cursor.iter_rows(FakeCursor(rows), COLUMNS, TYPES)) == rows
+
+
+def test_parse_row_dump_rejects_ambiguous_value():
+    dump = (
+        '0 {\n'
+        '   _display_name=a\n'
+        '   document_id=evil\n'
+        '   document_id=id1\n'
+        '   last_modified=1\n'
+        '   _size=2\n'
+        '}\n'
+    )
+    with pytest.raises(cursor.DumpFormatError):
+        cursor.parse_row_dump(dump, 0, COLUMNS)
+
+
+@pytest.mark.parametrize('dump', [
+    '',
+    '>>>>> Dumping cursor x\n0 {\n',
+    '>>>>> Dumping cursor x\n1 {\n}\n<<<<<\n',
+])
+def test_parse_cursor_dump_rejects_malformed(dump):
+    with pytest.raises(cursor.DumpFormatError):
+        cursor.parse_cursor_dump(dump, COLUMNS)
+
+
+def test_jni_calls_per_row():
+    # A paged read costs a moveToNext() and a row dump per row, plus
+    # the final moveToNext().
+    count = 100
+    c = FakeCursor(make_rows(count))
+    list(cursor.iter_rows(c, COLUMNS, TYPES))
+    assert c.calls == 2 * count + 1
+
+    # Cell by cell reads would cost a moveToNext() and a call per
+    # column for every row.
+    assert c.calls < count * (1 + len(COLUMNS))
+
+    # A bulk read is a dump and a count no matter how many rows.
+    c = FakeCursor(make_rows(count))
+    cursor.read_rows(c, COLUMNS, TYPES)
+    assert c.calls == 2
@@ -0,0 +1,129 @@
+"""Tests of the pure Python DocumentsContract URI helpers
+
+The expected strings are what android.net.Uri produces. Uri.encode()
+leaves ASCII letters, digits and _-!.~'()* alone and percent encodes
+everything else as uppercase UTF-8 escapes, with unpaired surrogates
+converted to '?' first. The authority is re-encoded the same way by
+Uri.Builder.authority().
+"""
+
+import pytest
+
+import uris
+
+EXTERNAL = 'com.android.externalstorage.documents'
+TREE = f'content://{EXTERNAL}/tree/primary%3ADCIM'
+
+# (document ID, Uri.encode(document ID))
+ENCODED_IDS = [
+    ('primary:DCIM', 'primary%3ADCIM'),
+    ('primary:DCIM/Camera', 'primary%3ADCIM%2FCamera'),
+    ('a b', 'a%20b'),
+    ('a#b?c', 'a%23b%3Fc'),
+    ('100%', '100%25'),
+    ('a+b=c&d', 'a%2Bb%3Dc%26d'),
+    ("a_b-c!d.e~f'g(h)i*j", "a_b-c!d.e~f'g(h)i*j"),
+    ('primary:Música', 'primary%3AM%C3%BAsica'),
+    ('日本', '%E6%97%A5%E6%9C%AC'),
+    ('\U0001f600', '%F0%9F%98%80'),
+    ('x\ud800y', 'x%3Fy'),
+    ('x\udfffy', 'x%3Fy'),
+    ('', ''),
+]
+
+
+@pytest.mark.parametrize('value,expected', ENCODED_IDS)
+def test_encode(value, expected):
+    assert uris.encode(value) == expected
+
+
+@pytest.mark.parametrize('value,encoded', ENCODED_IDS)
+def test_decode_round_trip(value, encoded):
+    if any('\ud800' <= c <= '\udfff' for c in value):
+        pytest.skip('unpaired surrogates are encoded lossily')
+    assert uris.decode(encoded) == value
+
+
+@pytest.mark.parametrize('value,expected', [
+    ('%41%42', 'AB'),
+    ('%c3%ba', 'ú'),
+    ('a+b', 'a+b'),
+    ('%zz', '\ufffdz'),
+    ('%4z', '\ufffd'),
+    ('a%', 'a\ufffd'),
+    ('a%4', 'a\ufffd'),
+    ('%C3', '\ufffd'),
+    ('%C3%BA%zz', 'ú\ufffdz'),
+])
+def test_decode(value, expected):
+    assert uris.decode(value) == expected
+
+
+@pytest.mark.parametrize('doc_id,expected', [
+    (
+        'primary:DCIM/a b#c?d%e.jpg',
+        f'{TREE}/document/primary%3ADCIM%2Fa%20b%23c%3Fd%25e.jpg',
+    ),
+    (
+        'primary:DCIM/日本/\U0001f600.png',
+        f'{TREE}/document/'
+        'primary%3ADCIM%2F%E6%97%A5%E6%9C%AC%2F%F0%9F%98%80.png',
+    ),
+    (
+        'primary:DCIM/x\ud800y',
+        f'{TREE}/document/primary%3ADCIM%2Fx%3Fy',
+    ),
+])
+def test_document_uri(doc_id, expected):
+    # Browser.make_entry() builds child URIs this way.
+    uri = uris.document_uri_prefix(TREE) + uris.encode(doc_id)
+    assert uri == expected
+
+
+def test_document_uri_prefix_from_document_uri():
+    doc_uri = f'{TREE}/document/primary%3ADCIM%2FCamera'
+    assert uris.document_uri_prefix(doc_uri) == f'{TREE}/document/'
+
+
+@pytest.mark.parametrize('uri,expected', [
+    (TREE, TREE),
+    (f'{TREE}/document/primary%3ADCIM%2Fa', TREE),
+    # Uri.Builder.authority() encodes the port separator.
+    ('content://host:8080/tree/x', 'content://host%3A8080/tree/x'),
+    ('content://host%3A8080/tree/x', 'content://host%3A8080/tree/x'),
+    ('content://a%20b/tree/x%20y', 'content://a%20b/tree/x%20y'),
+])
+def test_build_tree_uri(uri, expected):
+    assert uris.build_tree_uri(uri) == expected
+
+
+def test_get_document_id():
+    assert uris.get_document_id(
+        f'{TREE}/document/primary%3ADCIM%2Fa%20b%23c%3Fd%25e.jpg'
+    ) == 'primary:DCIM/a b#c?d%e.jpg'
+    assert uris.get_document_id(
+        f'content://{EXTERNAL}/document/primary%3Ax'
+    ) == 'primary:x'
+
+
+def test_get_document_id_ignores_query_and_fragment():
+    assert uris.get_document_id(
+        f'{TREE}/document/primary%3Ax?a=b#c'
+    ) == 'primary:x'
+
+
+def test_get_tree_document_id():
+    assert uris.get_tree_document_id(TREE) == 'primary:DCIM'
+    assert uris.get_tree_document_id(
+        f'{TREE}/document/primary%3ADCIM%2Fa'
+    ) == 'primary:DCIM'
+
+
+@pytest.mark.parametrize('uri', [
+    'content://host/other/x',
+    'content://host/tree',
+    'no-scheme',
+])
+def test_invalid_uri(uri):
+    with pytest.raises(ValueError):
+        uris.get_document_id(uri)